@@ -0,0 +1,309 @@
+#!/usr/bin/env python3
+
+import glob
+import io
+import os
+import subprocess
+import tempfile
+import time
+import tracemalloc
+
+from cc import *
+from rvsim import RiscvSimulator
+
+
+def timed(fn, repeat=3):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def gen_many_procedures(n):
+    procs = "".join(f"""
+    procedure p{i}(in x, inout y) {{
+        declare a;
+        a := x * 2 + {i};
+        y := y + a;
+        print(y);
+    }}
+""" for i in range(n))
+    calls = "".join(f"    call p{i}(in x, inout x);\n" for i in range(n))
+    return f"program many {{\n    declare x;\n{procs}\n    x := 1;\n{calls}    print(x)\n}}."
+
+
+def compile_src(src):
+    parser = Parser(Lex(src))
+    parser.parse_program()
+    return parser
+
+
+def bench_many_procedures():
+    print("many procedures: total compile time should grow linearly with the number of procedures")
+    print("%8s %8s %12s %14s" % ("procs", "quads", "total (s)", "per quad (us)"))
+    for n in (100, 200, 400, 800, 1600):
+        src = gen_many_procedures(n)
+        quads = len(compile_src(src).quads)
+        t = timed(lambda: compile_src(src))
+        print("%8d %8d %12.4f %14.2f" % (n, quads, t, t / quads * 1e6))
+
+
+def gen_deeply_nested(depth, stmts):
+    def block(level):
+        inner = block(level + 1) if level < depth else ""
+        body = "".join(f"        v{level} := v0 + v{level} * {i};\n" for i in range(stmts))
+        return f"procedure p{level}(in v{level}) {{\n{inner}\n{body}    }}\n"
+
+    return f"program nested {{\n    declare v0;\n{block(1)}\n    call p1(in v0)\n}}."
+
+
+def bench_symbol_lookups():
+    print("symbol lookups: deeply nested scopes touching outer variables")
+    print("%8s %8s %12s %14s" % ("depth", "quads", "total (s)", "per quad (us)"))
+    for depth in (10, 20, 40, 80):
+        src = gen_deeply_nested(depth, 50)
+        quads = len(compile_src(src).quads)
+        t = timed(lambda: compile_src(src))
+        print("%8d %8d %12.4f %14.2f" % (depth, quads, t, t / quads * 1e6))
+
+
+def peak_memory(fn):
+    tracemalloc.start()
+    fn()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak
+
+
+def bench_token_streaming():
+    print("token streaming: peak memory of parsing with the full token list vs. the streamed lookahead")
+    print("%8s %10s %14s %14s" % ("procs", "src (KB)", "list (MB)", "stream (MB)"))
+    for n in (200, 800):
+        src = gen_many_procedures(n)
+        peaks = []
+        for stream in (False, True):
+            peaks.append(peak_memory(lambda: Parser(Lex(src), stream=stream).parse_program()))
+        print("%8d %10d %14.2f %14.2f" % (n, len(src) / 1024, peaks[0] / 2 ** 20, peaks[1] / 2 ** 20))
+
+
+class DictFilePos:  # FilePos, Token and Quad as they were before using __slots__
+    def __init__(self, ln=0, cl=0):
+        self.ln, self.cl = ln, cl
+
+
+class DictToken:
+    def __init__(self, lexer, value, cursor):
+        self.lex = lexer
+        self.value = value
+        self.cursor = cursor
+
+
+class DictQuad:
+    def __init__(self, label="", op="", x="", y="", z=""):
+        self.label = label
+        self.op = op
+        self.x = x
+        self.y = y
+        self.z = z
+
+
+def bench_representation_memory():
+    print("representations: bytes per token (incl. its FilePos) and per quad, dict based vs slotted classes")
+    parser = compile_src(gen_many_procedures(800))
+    tokens = list(iter(Lex(gen_many_procedures(800)).next_token, None))
+
+    print("%12s %14s %14s" % ("classes", "token (B)", "quad (B)"))
+    for name, token_class, pos_class, quad_class in (("dict", DictToken, DictFilePos, DictQuad),
+                                                     ("slots", Token, FilePos, Quad)):
+        token_bytes = peak_memory(lambda: [token_class(t.lex, t.value, pos_class(t.cursor.ln, t.cursor.cl))
+                                           for t in tokens])
+        quad_bytes = peak_memory(lambda: [quad_class(q.label, q.op, q.x, q.y, q.z) for q in parser.quads])
+        print("%12s %14.1f %14.1f" % (name, token_bytes / len(tokens), quad_bytes / len(parser.quads)))
+
+
+def bench_lexers():
+    print("lexers: tokens/second over the example programs repeated up to ~2MB")
+    examples = "\n".join(open(f).read() for f in sorted(glob.glob("examples/*.ci")))
+    src = "\n".join([examples] * (2 * 2 ** 20 // len(examples)))
+    print("%12s %10s %10s %12s %14s" % ("lexer", "size (MB)", "tokens", "total (s)", "tokens/s"))
+    for lex_class in (Lex, RegexLex):
+        tokens = []
+        t = timed(lambda: tokens.append(sum(1 for _ in iter(lex_class(src).next_token, None))), repeat=1)
+        print("%12s %10.2f %10d %12.4f %14.0f" % (lex_class.__name__, len(src) / 2 ** 20, tokens[0], t, tokens[0] / t))
+
+
+def count_memory_ops(parser):
+    statements = parser.asm_generator.statements
+    return sum(s.startswith("lw ") for s in statements), sum(s.startswith("sw ") for s in statements)
+
+
+def bench_register_allocation():
+    print("register allocation: loads/stores emitted without and with --regalloc")
+    print("%24s %16s %16s" % ("program", "loads", "stores"))
+    programs = [(f, open(f).read()) for f in sorted(glob.glob("examples/*.ci"))]
+    programs.append(("many procedures (100)", gen_many_procedures(100)))
+    for name, src in programs:
+        counts = []
+        for regalloc in (False, True):
+            parser = Parser(Lex(src), regalloc=regalloc)
+            parser.parse_program()
+            counts.append(count_memory_ops(parser))
+        print("%24s %7d -> %-6d %7d -> %-6d" % (name.replace("examples/", ""), counts[0][0], counts[1][0],
+                                                counts[0][1], counts[1][1]))
+
+
+class NoCseOptimizer(Optimizer):
+    def eliminate_common_subexpressions(self, quads):
+        return quads
+
+
+def bench_common_subexpressions():
+    print("common subexpressions: arithmetic quads with -O, without and with their elimination")
+    print("%24s %10s %10s" % ("program", "no cse", "cse"))
+    programs = [(f.replace("examples/", ""), open(f).read()) for f in sorted(glob.glob("examples/*.ci"))]
+    programs.append(("repeated (a+b)", """
+    program repeated {
+        declare a, b, c;
+        input(a); input(b);
+        c := (a + b) * (a + b) - (a + b) / 2;
+        while (c > a + b) { c := c - (a + b) * 2 };
+        print(c + (a + b))
+    }."""))
+    for name, src in programs:
+        counts = []
+        for optimizer_class in (NoCseOptimizer, Optimizer):
+            parser = Parser(Lex(src), optimize=True)
+            parser.optimizer = optimizer_class(parser)
+            parser.parse_program()
+            counts.append(sum(q.op in ("+", "-", "*", "/") for q in parser.quads))
+        print("%24s %10d %10d" % (name, counts[0], counts[1]))
+
+
+def gen_outer_accesses(depth):  # the innermost procedure sums the variables of all the enclosing ones in a loop
+    def block(level):
+        inner = block(level + 1) if level < depth else ""
+        body = f"call p{level + 1}()" if level < depth else \
+            "i := 0; while (i < 100) {" + "".join(f"s := s + v{k}; " for k in range(1, depth + 1)) + "i := i + 1}"
+        return f"procedure p{level}() {{\ndeclare v{level};\n{inner}\nv{level} := {level}; {body}\n}}\n"
+
+    return f"program outer {{\n    declare s, i;\n{block(1)}\n    s := 0; call p1(); print(s)\n}}."
+
+
+def bench_nonlocal_access():
+    print("nonlocal access: loads emitted in the innermost procedure, following access links vs. the display")
+    print("%8s %12s %12s" % ("depth", "links", "display"))
+    for depth in (2, 4, 8, 16):
+        counts = []
+        for display in (False, True):
+            parser = Parser(Lex(gen_outer_accesses(depth)), display=display)
+            parser.parse_program()
+            start, end = parser.asm_generator.compiled_blocks["p%d__0" % depth]["statements"]
+            counts.append(sum(s.startswith("lw ") for s in parser.asm_generator.statements[start:end]))
+        print("%8d %12d %12d" % (depth, counts[0], counts[1]))
+
+
+def bench_interpreter():
+    print("quad interpreter: runs/second of the example programs")
+    print("%24s %8s %12s %10s" % ("program", "stdin", "total (s)", "runs/s"))
+    for name, stdin in (("examples/02_fib1.ci", "20"), ("examples/04_digitcount.ci", "123456789"),
+                        ("examples/06_sum.ci", "100")):
+        parser = Parser(Lex(open(name).read()), interpret=True)
+        parser.parse_program()
+        runs = 1000
+        t = timed(lambda: [parser.interpreter.run(io.StringIO(stdin), io.StringIO()) for _ in range(runs)], repeat=1)
+        print("%24s %8s %12.4f %10.0f" % (name.replace("examples/", ""), stdin, t, runs / t))
+
+
+def gen_primes(bound):  # examples/05_primes.ci up to bound, incrementing i, which the example doesn't
+    src = open("examples/05_primes.ci").read()
+    return src.replace("while (i <= 30)", "while (i <= %d) {" % bound).replace("print(i);;", "print(i);; i := i + 1 };")
+
+
+def bench_jit():
+    print("jit: examples/05_primes.ci with larger bounds, quad interpreter vs. quads compiled to Python functions")
+    print("%8s %8s %14s %12s %10s" % ("bound", "primes", "interpret (s)", "jit (s)", "speedup"))
+    for bound in (500, 1000, 2000):
+        src, times = gen_primes(bound), []
+        for jit in (False, True):
+            parser = Parser(Lex(src), interpret=True, jit=jit)
+            parser.parse_program()
+            stdout = io.StringIO()
+            parser.interpreter.run(io.StringIO(), stdout)  # the jit compiles the program on its first run
+            times.append(timed(lambda: parser.interpreter.run(io.StringIO(), io.StringIO())))
+        primes = len(stdout.getvalue().split())
+        print("%8d %8d %14.4f %12.4f %10.1f" % (bound, primes, times[0], times[1], times[0] / times[1]))
+
+
+def bench_executed_instructions():
+    print("executed instructions: the generated code run by rvsim, with each optimization flag")
+    flags = (("none", {}), ("-O", {"optimize": True}), ("--regalloc", {"regalloc": True}),
+             ("--display", {"display": True}), ("all", {"optimize": True, "regalloc": True, "inline_threshold": 20}))
+    print("%24s" % "program" + "".join("%12s" % name for name, _ in flags))
+    programs = (("02_fib1.ci", open("examples/02_fib1.ci").read(), "30"), ("05_primes.ci (500)", gen_primes(500), ""),
+                ("06_sum.ci", open("examples/06_sum.ci").read(), "1000"),
+                ("outer accesses (4)", gen_outer_accesses(4), ""))
+    for name, src, stdin in programs:
+        counts = []
+        for _, kwargs in flags:
+            parser = Parser(Lex(src), **kwargs)
+            parser.parse_program()
+            simulator = RiscvSimulator(parser.asm_generator.gen_asm_equivalent(), io.StringIO(stdin), io.StringIO())
+            counts.append(simulator.run()["instructions"])
+        print("%24s" % name + "".join("%12d" % count for count in counts))
+
+
+def build_c(parser, directory, name, flags=(), structured=False):
+    c_src, c_bin = os.path.join(directory, name + ".c"), os.path.join(directory, name)
+    with open(c_src, "w") as fp:
+        fp.write(parser.gen_c_equivalent(structured=structured))
+    subprocess.check_output(["gcc", *flags, "-o", c_bin, c_src], stderr=subprocess.DEVNULL)
+    return c_bin
+
+
+def bench_native_c():
+    print("native C: examples/05_primes.ci with larger bounds, generated code in rvsim vs. the C equivalent with gcc")
+    print("%8s %12s %12s %10s" % ("bound", "rvsim (s)", "gcc (s)", "speedup"))
+    with tempfile.TemporaryDirectory() as directory:
+        for bound in (200, 400, 800):
+            parser = Parser(Lex(gen_primes(bound)), optimize=True)
+            parser.parse_program()
+            asm = parser.asm_generator.gen_asm_equivalent()
+            c_bin = build_c(parser, directory, "primes%d" % bound)
+            sim = timed(lambda: RiscvSimulator(asm, io.StringIO(), io.StringIO()).run(), repeat=1)
+            native = timed(lambda: subprocess.check_output([c_bin]))  # includes starting the process
+            print("%8d %12.4f %12.4f %10.0f" % (bound, sim, native, sim / native))
+
+
+def bench_structured_c():
+    print("structured C: examples/05_primes.ci with larger bounds, a goto per quad vs. loops and ifs, gcc -O2")
+    print("%8s %12s %12s %10s %10s" % ("bound", "goto (s)", "struct (s)", "speedup", "gotos"))
+    with tempfile.TemporaryDirectory() as directory:
+        for bound in (40000, 80000, 120000):  # runs for 0.1 to 1.5 s, so starting the process doesn't matter
+            parser = Parser(Lex(gen_primes(bound)), optimize=True)
+            parser.parse_program()
+            gotos = parser.gen_c_equivalent().count("goto "), parser.gen_c_equivalent(structured=True).count("goto ")
+            flat = build_c(parser, directory, "flat%d" % bound, flags=("-O2",))
+            structured = build_c(parser, directory, "structured%d" % bound, flags=("-O2",), structured=True)
+            flat_time = timed(lambda: subprocess.check_output([flat]))
+            structured_time = timed(lambda: subprocess.check_output([structured]))
+            print("%8d %12.4f %12.4f %10.2f %4d -> %d" % (bound, flat_time, structured_time,
+                                                          flat_time / structured_time, *gotos))
+
+
+if __name__ == "__main__":
+    bench_many_procedures()
+    bench_symbol_lookups()
+    bench_token_streaming()
+    bench_representation_memory()
+    bench_lexers()
+    bench_register_allocation()
+    bench_common_subexpressions()
+    bench_nonlocal_access()
+    bench_interpreter()
+    bench_jit()
+    bench_executed_instructions()
+    bench_native_c()
+    bench_structured_c()
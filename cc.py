@@ -1,5 +1,8 @@
 #!/usr/bin/env python3
 
+import argparse
+import operator
+import re
 import string
 import sys
 
@@ -16,27 +19,110 @@ MUL_OPS = {"*", "/"}
 
 
 class AsmGenerator:
-    def __init__(self, code_parser):
+    """
+    Activation records grow upwards, sp points to the top of the current one and the slots are at negative offsets:
+    (sp) return address, -4(sp) access link, -8(sp) address of the return value, -12(sp)... parameters, variables
+    and temporaries. Callers set fp to the callee's sp while passing the parameters. With -O, leaf subprograms (the
+    ones without calls) keep fp as their frame pointer instead, so their callers don't move sp and they don't save ra.
+    With a display, tp points to a table with the frame of the most recent call of each nesting level instead of
+    following the access links, subprograms with nested ones save the previous entry of their level in their frame.
+    """
+
+    SAVED_REGS = ["s%d" % i for i in range(1, 12)]  # callee saved, s0 is fp
+    TMP_REGS = ["t3", "t4", "t5", "t6"]  # caller saved, t0-t2 are scratch registers
+    LEAF_REGS = ["a1", "a2", "a3", "a4", "a5", "a6"]  # caller saved and left alone by ecall, used by leaves
+    SCRATCH_REGS = {"t0", "t1", "t2"}  # never hold a value across quads or calls
+    JUMP_OPS = {"j", "jal", "beq", "bne", "bgt", "blt", "bge", "ble"}
+    WRITE_OPS = {"lw", "li", "la", "mv", "add", "sub", "mul", "div", "addi", "slli", "srli", "srai"}  # write operand 1
+
+    def __init__(self, code_parser, regalloc=False, optimize=False, display=False):
         self.parser = code_parser
+        self.regalloc = regalloc
+        self.display = display  # nonlocal variables are reached through the display instead of the access links
+        self.display_levels = 0  # entries of the display, level 0 is main's frame, which is in gp
+        self.display_slot = None  # frame offset of the saved display entry, in blocks with nested subprograms
+        self.optimize = optimize  # strength reduction and peephole optimizations
+        self.peephole_stats = {"load after store": 0, "jump to next": 0, "dead move": 0, "unreachable": 0}
         self.statements = []
+        self.compiled_blocks = {}  # asm label -> ranges of the block's quads and statements, and the labels it calls
+        self.next_quad_idx = 0  # index of the first quad that has not been compiled yet
+        self.label_seq = 0
+        self.symbols = {}  # framelength symbol -> entity, for subprograms that were called before being compiled
+        self.registers = {}  # variable -> register, for the block that is being compiled
+        self.saved_regs = []  # callee saved registers that the block uses
+        self.entry_loads = []  # variables in registers that are read before being written in the block
+        self.par_idx = None  # index of the next parameter, while passing parameters to a callee
+        self.frame = "sp"  # the register that points to the frame of the block that is being compiled
 
     def compile_block(self, block_name):
-        inside_block = False
-        for q in self.parser.quads:
-            if q.x == block_name and q.op == "begin_block":
-                inside_block = True
-            if inside_block:
-                self.statements += self.quad_to_asm(q)
+        # subprograms are parsed (and compiled) before the begin_block of their parent, so the quads of a
+        # finished block are always the ones emitted after the previously compiled block.
+        quads = self.parser.quads
+        leaf = self.optimize and self.current_scope() > 0 and all(q.op != "call" for q in quads[self.next_quad_idx:])
+        if leaf:
+            self.current_entity()["leaf"] = True
+        self.frame = "fp" if leaf else "sp"
+        scope = self.parser.st.scopes[-1]
+        self.display_slot = None
+        if self.display and self.current_scope() > 0 and \
+                (scope["entities"]["functions"] or scope["entities"]["procedures"]):
+            self.display_slot, scope["offset"] = scope["offset"], scope["offset"] + 4
+            self.display_levels = max(self.display_levels, self.current_scope() + 1)
+        if self.regalloc:
+            self.allocate_registers(quads[self.next_quad_idx:])
+
+        asm, start = [], self.next_quad_idx
+        while self.next_quad_idx < len(quads):
+            q = quads[self.next_quad_idx]
+            self.next_quad_idx += 1
+            asm += self.quad_to_asm(q)
             if q.x == block_name and q.op == "end_block":
                 break
+        asm = self.optimize_asm(asm) if self.optimize else asm
+
+        label = "Lmain" if self.current_scope() == 0 else self.subprogram_label(block_name, self.current_entity())
+        self.compiled_blocks[label] = {"quads": (start, self.next_quad_idx),
+                                       "statements": (len(self.statements), len(self.statements) + len(asm)),
+                                       "calls": {ins.split()[1] for ins in asm if ins.split()[0] in ("jal", "j")
+                                                 and "__" in ins}}  # subprogram labels, tail calls jump to them
+        self.statements += asm
 
     def current_scope(self):
         return len(self.parser.st.scopes) - 1
 
-    def gnvlcode(self, var):  # t0 = &var
+    def current_entity(self):  # entity of the subprogram that is being compiled
+        name = self.parser.st.scopes[-1]["name"]
+        entities = self.parser.st.scopes[-2]["entities"]
+        return entities["functions"].get(name) or entities["procedures"].get(name)
+
+    def subprogram_label(self, name, ent):  # subprograms in different scopes can share a name
+        if "label" not in ent:
+            ent["label"] = "%s__%d" % (name, self.label_seq)
+            self.label_seq += 1
+        return ent["label"]
+
+    def framelength(self, name, ent):
+        if "framelength" in ent:
+            return ent["framelength"]
+        if ent is self.current_entity():  # recursive call
+            return self.parser.st.scopes[-1]["offset"]
+        # an enclosing subprogram that is still being parsed, its framelength is known after it's compiled
+        symbol = "framelength_" + self.subprogram_label(name, ent)
+        self.symbols[symbol] = ent
+        return symbol
+
+    def find_variable(self, var):
         ent = self.parser.st.find_entity(name=var, categories=("variables", "tmp_variables", "parameters"))
-        offset_repeat = self.current_scope() - ent["scope"]
-        return ["lw t0,-4(sp)"] + ["lw t0,-4(t0)"] * offset_repeat + ["addi t0,t0,-%d" % ent["offset"]]
+        if ent["scope"] != self.current_scope():
+            ent["nonlocal"] = True  # accessed by a nested subprogram, so it has to stay in memory
+        return ent
+
+    def gnvlcode(self, var):  # t0 = &var
+        ent = self.find_variable(var)
+        if self.display:
+            return ["lw t0,%d(tp)" % (4 * ent["scope"]), "addi t0,t0,-%d" % ent["offset"]]
+        offset_repeat = self.current_scope() - ent["scope"] - 1
+        return ["lw t0,-4(%s)" % self.frame] + ["lw t0,-4(t0)"] * offset_repeat + ["addi t0,t0,-%d" % ent["offset"]]
 
     def loadvr(self, var, tr):  # tr = var
         try:
@@ -49,102 +135,695 @@ class AsmGenerator:
         return self.sl_vr(var, tr, store=True)
 
     def sl_vr(self, var, tr, store=False):  # if store=True then storerv else loadvr
-        ent = self.parser.st.find_entity(name=var, categories=("variables", "parameters", "tmp_variables"))
+        ent = self.find_variable(var)
         stmt = "sw" if store else "lw"
 
-        if ent["offset"] == 0:  # global var (declared in main)
+        if ent["scope"] == self.current_scope():  # variable is declared in current func
+            if ent.get("mode") == "inout":
+                return ["lw t0,-%d(%s)" % (ent["offset"], self.frame), "%s %s,(t0)" % (stmt, tr)]
+            return ["%s %s,-%d(%s)" % (stmt, tr, ent["offset"], self.frame)]
+        elif ent["scope"] == 0:  # global var (declared in main)
             return ["%s %s,-%d(gp)" % (stmt, tr, ent["offset"])]
-        elif self.current_scope() - ent["scope"]:  # variable is declared in current func
-            if "mode" in ent and ent["mode"] == "inout":
-                return ["lw t0,-%d(sp)" % ent["offset"], "%s tr,(t0)" % stmt]
-            return ["%s %s,-%d(sp)" % (stmt, tr, ent["offset"])]
         else:  # variable declared in ancestor
             asm = self.gnvlcode(var)
-            if "mode" in ent and ent["mode"] == "inout":
+            if ent.get("mode") == "inout":
                 asm += ["lw t0,(t0)"]
-            return asm + ["%s tr,(t0)" % stmt]
+            return asm + ["%s %s,(t0)" % (stmt, tr)]
+
+    def operand(self, var, tr):  # returns the instructions and the register that will hold the value of var
+        if var in self.registers:
+            return [], self.registers[var]
+        return self.loadvr(var, tr), tr
+
+    def assign(self, tr, var):  # var = tr
+        if var in self.registers:
+            return [] if tr == self.registers[var] else ["mv %s,%s" % (self.registers[var], tr)]
+        return self.storerv(tr, var)
+
+    def prologue(self, q):
+        if q.z == "main":
+            asm = ["Lmain:", "addi sp,sp,%d" % self.parser.st.scopes[-1]["offset"], "mv gp,sp"]
+            asm += ["la tp,display"] if self.display_levels else []
+        else:
+            base = self.parser.st.scopes[-1]["offset"] - 4 * len(self.saved_regs)
+            asm = [self.subprogram_label(q.x, self.current_entity()) + ":"]
+            asm += [] if self.frame == "fp" else ["sw ra,(sp)"]  # leaves don't overwrite ra
+            asm += ["sw %s,-%d(%s)" % (reg, base + 4 * i, self.frame) for i, reg in enumerate(self.saved_regs)]
+            if self.display_slot is not None:
+                level = 4 * self.current_scope()
+                asm += ["lw t0,%d(tp)" % level, "sw t0,-%d(%s)" % (self.display_slot, self.frame),
+                        "sw %s,%d(tp)" % (self.frame, level)]
+
+        for var in self.entry_loads:  # e.g. parameters, they have been passed in memory
+            asm += self.loadvr(var, self.registers[var])
+        return asm
+
+    def epilogue(self):
+        base = self.parser.st.scopes[-1]["offset"] - 4 * len(self.saved_regs)
+        asm = ["lw %s,-%d(%s)" % (reg, base + 4 * i, self.frame) for i, reg in enumerate(self.saved_regs)]
+        if self.display_slot is not None:
+            asm += ["lw t0,-%d(%s)" % (self.display_slot, self.frame), "sw t0,%d(tp)" % (4 * self.current_scope())]
+        return asm + ([] if self.frame == "fp" else ["lw ra,(sp)"]) + ["jr ra"]
 
     def quad_to_asm(self, q):
         asm = [q.label + ":"]
-        framelength = self.parser.st.scopes[-1]["offset"]
 
         if q.op == "begin_block":
-            if q.z == "main":
-                asm += ["Lmain:", "addi sp,sp,%d" % framelength, "mv gp,sp"]
-            else:
-                asm += ["add sp,sp,%d" % framelength] + ["sw ra,(sp)"]
-            return asm
+            return asm + self.prologue(q)
         elif q.op == "end_block":
-            return asm
+            return asm + ([] if self.current_scope() == 0 else self.epilogue())
         elif q.op == ":=":
-            return asm + self.loadvr(q.x, "t1") + self.storerv("t1", q.z)
+            if q.z in self.registers and q.x not in self.registers:
+                return asm + self.loadvr(q.x, self.registers[q.z])
+            x_asm, rx = self.operand(q.x, "t1")
+            return asm + x_asm + self.assign(rx, q.z)
         elif q.op in ("+", "-", "*", "/"):
-            stmt = {"+": "add", "-": "sub", "*": "mul", "/": "div"}[q.op]
-            return asm + self.loadvr(q.x, "t1") + self.loadvr(q.y, "t2") + \
-                   ["%s, t1, t1, t2" % stmt] + self.storerv("t1", q.z)
+            return asm + self.arithmetic(q)
         elif q.op == "jump":
             return asm + ["j %s" % q.z]
         elif q.op in ("=", "<>", ">", "<", ">=", "<="):
             stmt = {"=": "beq", "<>": "bne", ">": "bgt", "<": "blt", ">=": "bge", "<=": "ble"}[q.op]
-            return asm + self.loadvr(q.x, "t1") + self.loadvr(q.y, "t2") + ["%s t1,t2,%s" % (stmt, q.label)]
+            x_asm, rx = self.operand(q.x, "t1")
+            y_asm, ry = self.operand(q.y, "t2")
+            return asm + x_asm + y_asm + ["%s %s,%s,%s" % (stmt, rx, ry, q.z)]
         elif q.op == "retv":
-            return asm + self.loadvr(q.x, "t1") + ["lw t0,-8(sp)", "sw t1,(t0)"]
+            x_asm, rx = self.operand(q.x, "t1")
+            return asm + x_asm + ["lw t0,-8(%s)" % self.frame, "sw %s,(t0)" % rx] + self.epilogue()
         elif q.op == "call":
-            ent = self.parser.st.find_entity(q.x, categories=("functions", "procedures",))
-            if ent["scope"] == self.current_scope():
-                asm = ["lw t0,-4(sp)", "sw t0,-4(fp)"] + asm
-            else:
-                asm = ["sw sp,-4(fp)"] + asm
-            return asm + ["addi sp,sp,%d" % framelength, "jal %s" % q.x, "add sp,sp,-%d" % framelength]
+            return asm + self.call(q)
         elif q.op == "out":
-            return asm + self.loadvr(q.x, "t1") + ["mv a0,t1", "li a7,1", "ecall"] + \
-                   ["la a0,str_nl", "li a7,4", "ecall"]
+            x_asm, rx = self.operand(q.x, "t1")
+            return asm + x_asm + ["mv a0,%s" % rx, "li a7,1", "ecall"] + ["la a0,str_nl", "li a7,4", "ecall"]
         elif q.op == "inp":
-            return asm + ["li a7,5", "ecall"] + self.storerv("a0", q.x)
+            return asm + ["li a7,5", "ecall"] + self.assign("a0", q.x)
         elif q.op == "par":
-            ent = self.parser.st.find_entity(q.x, categories=("parameters", "tmp_variables", "variables"))
-            if q.y == "REF":
-                if self.current_scope() == ent["scope"]:  # variable is declared in current func
-                    asm += ["addi t0,sp,-%d" % ent["offset"]]
-                else:
-                    self.gnvlcode(q.x)
-            if q.y in ("REF", "CV"):
-                try:
-                    const = int(q.x)
-                    return asm + [f"sw t0,{const}"]
-                except ValueError:
-                    return asm + self.loadvr(q.x, "t0") + ["sw t0,(-%d)(fp)" % (12 + ent["offset"])]
-            if q.y == "RET":
-                return asm + ["addi t0,sp,-%d" % ent["offset"], "sw t0,-8(fp)"]
+            return asm + self.par(q)
         elif q.op == "halt":
             return asm + ["li a0,0", "li a7,93", "ecall"]
 
         raise Exception("invalid quad operator: %s" % q.op)
 
+    def arithmetic(self, q):
+        x, y = (q.y, q.x) if self.optimize and q.op in ("+", "*") and Optimizer.is_const(q.x) else (q.x, q.y)
+        x_asm, rx = self.operand(x, "t1")
+        rz = self.registers.get(q.z, "t1")
+
+        if self.optimize and Optimizer.is_const(y):  # strength reduction, y is an immediate or a shift amount
+            c = Optimizer.wrap32(int(y)) * (-1 if q.op == "-" else 1)
+            k = c.bit_length() - 1 if c > 0 and c & (c - 1) == 0 else None  # c = 2^k
+            if q.op in ("+", "-") and -2048 <= c < 2048:
+                return x_asm + ["addi %s,%s,%d" % (rz, rx, c)] + self.assign(rz, q.z)
+            elif q.op == "*" and k is not None:
+                return x_asm + ["slli %s,%s,%d" % (rz, rx, k)] + self.assign(rz, q.z)
+            elif q.op == "/" and k == 0:
+                return x_asm + ["mv %s,%s" % (rz, rx)] + self.assign(rz, q.z)
+            elif q.op == "/" and k is not None:  # adds 2^k-1 to negative dividends, so it rounds towards zero
+                return x_asm + ["srai t0,%s,31" % rx, "srli t0,t0,%d" % (32 - k), "add t0,%s,t0" % rx,
+                                "srai %s,t0,%d" % (rz, k)] + self.assign(rz, q.z)
+
+        stmt = {"+": "add", "-": "sub", "*": "mul", "/": "div"}[q.op]
+        y_asm, ry = self.operand(y, "t2")
+        return x_asm + y_asm + ["%s %s,%s,%s" % (stmt, rz, rx, ry)] + self.assign(rz, q.z)
+
+    def callee_frame(self, name):  # fp = sp of the callee
+        ent = self.parser.st.find_entity(name, categories=("functions", "procedures",))
+        return ["addi fp,sp,%s" % self.framelength(name, ent)]
+
+    def par(self, q):
+        asm = []
+        if self.par_idx is None:  # the first parameter of the next call quad
+            call = next(c for c in self.parser.quads[self.next_quad_idx:] if c.op == "call")
+            asm, self.par_idx = self.callee_frame(call.x), 0
+
+        if q.y == "RET":
+            return asm + ["addi t0,sp,-%d" % self.find_variable(q.x)["offset"], "sw t0,-8(fp)"]
+
+        if q.y == "CV":
+            x_asm, rx = self.operand(q.x, "t0")
+            asm += x_asm
+        else:
+            ent = self.find_variable(q.x)
+            if ent["scope"] == self.current_scope():  # variable is declared in current func
+                asm += ["lw t0,-%d(sp)" % ent["offset"] if ent.get("mode") == "inout" else
+                        "addi t0,sp,-%d" % ent["offset"]]
+            elif ent["scope"] == 0:
+                asm += ["addi t0,gp,-%d" % ent["offset"]]
+            else:
+                asm += self.gnvlcode(q.x) + (["lw t0,(t0)"] if ent.get("mode") == "inout" else [])
+            rx = "t0"
+
+        self.par_idx += 1
+        return asm + ["sw %s,-%d(fp)" % (rx, 8 + 4 * self.par_idx)]
+
+    def call(self, q):
+        ent = self.parser.st.find_entity(q.x, categories=("functions", "procedures",))
+        asm = self.callee_frame(q.x) if self.par_idx is None else []
+        self.par_idx = None
+
+        levels_up = self.current_scope() - ent["scope"]  # the callee's access link is the frame of its parent
+        if self.display:
+            pass  # the callee finds the frames of its ancestors in the display
+        elif levels_up == 0:
+            asm += ["sw sp,-4(fp)"]
+        else:
+            asm += ["lw t0,-4(sp)"] + ["lw t0,-4(t0)"] * (levels_up - 1) + ["sw t0,-4(fp)"]
+
+        framelength = self.framelength(q.x, ent)
+        if self.optimize and levels_up > 0 and self.is_tail_call(framelength):
+            return asm + self.tail_call(self.subprogram_label(q.x, ent), ent)
+        if ent.get("leaf"):  # its frame is above ours, at fp
+            return asm + ["jal %s" % self.subprogram_label(q.x, ent)]
+
+        return asm + ["addi sp,sp,%s" % framelength, "jal %s" % self.subprogram_label(q.x, ent),
+                      "addi sp,sp,-%s" % framelength]
+
+    def call_pars(self):  # the par quads of the call quad that is being compiled
+        quads, start = self.parser.quads, self.next_quad_idx - 1
+        while quads[start - 1].op == "par":
+            start -= 1
+        return quads[start:self.next_quad_idx - 1]
+
+    def is_tail_call(self, framelength):  # the callee's result, if any, is returned right away
+        # our caller frees the callee's frame by the length of ours, so the callee's one has to fit in it
+        if self.current_scope() == 0 or not isinstance(framelength, int) or \
+                framelength > self.parser.st.scopes[-1]["offset"]:
+            return False
+        pars = self.call_pars()
+        for par in pars:
+            ent = self.find_variable(par.x) if par.y == "REF" else None
+            if ent and ent["scope"] == self.current_scope() and ent.get("mode") != "inout":
+                return False  # a reference to our frame
+
+        quads = self.parser.quads
+        after = quads[self.next_quad_idx]
+        while after.op == "jump":
+            after = next(q for q in quads[self.next_quad_idx:] if q.label == after.z)
+        if pars and pars[-1].y == "RET":
+            return after.op == "retv" and after.x == pars[-1].x
+        return after.op == "end_block"
+
+    def tail_call(self, label, ent):
+        # the callee's frame is built above ours as usual, then moved down to the top of ours, so it returns
+        # straight to our caller, and to our return value's address
+        words = 2 + sum(par.y != "RET" for par in self.call_pars())  # access link, return value address, pars
+        asm = ["lw t0,-8(sp)", "sw t0,-8(fp)"] + self.epilogue()[:-1]  # restores the registers, without returning
+        for offset in range(4 * words, 0, -4):  # upwards, the frames overlap when the callee's one is small
+            asm += ["lw t0,-%d(fp)" % offset, "sw t0,-%d(sp)" % offset]
+        return asm + (["mv fp,sp"] if ent.get("leaf") else []) + ["j %s" % label]
+
+    def allocate_registers(self, quads):  # linear scan over the live ranges of the block's variables
+        scope = self.parser.st.scopes[-1]
+        in_memory = {q.x for q in quads if q.op == "par" and q.y in ("REF", "RET")}  # their address is passed
+        candidates = {name for cat in ("variables", "tmp_variables", "parameters")
+                      for name, ent in scope["entities"][cat].items()
+                      if ent.get("mode") != "inout" and not ent.get("nonlocal") and name not in in_memory}
+
+        live_in = Optimizer.liveness(quads, candidates)
+        ranges = Optimizer.live_ranges(quads, live_in, candidates)
+        calls = [i for i, q in enumerate(quads) if q.op == "call"]
+
+        self.registers, active = {}, []  # active: (last, var) of the ranges that hold a register
+        free = {"saved": list(self.SAVED_REGS), "tmp": self.TMP_REGS + (self.LEAF_REGS if self.frame == "fp" else [])}
+        for var, (first, last) in sorted(ranges.items(), key=lambda r: r[1]):
+            for a in [a for a in active if a[0] < first]:
+                active.remove(a)
+                reg = self.registers[a[1]]
+                free["saved" if reg in self.SAVED_REGS else "tmp"].append(reg)
+
+            across_call = any(first < c < last for c in calls)  # caller saved registers would be overwritten
+            if not across_call and free["tmp"]:
+                reg = free["tmp"].pop(0)
+            elif free["saved"]:
+                reg = free["saved"].pop(0)
+            else:  # spill the range that ends last, it stays in memory
+                usable = [a for a in active if not across_call or self.registers[a[1]] in self.SAVED_REGS]
+                spilled = max(usable, default=None)
+                if spilled is None or spilled[0] <= last:
+                    continue
+                active.remove(spilled)
+                reg = self.registers.pop(spilled[1])
+
+            self.registers[var] = reg
+            active.append((last, var))
+
+        self.entry_loads = sorted(v for v in live_in[0] if v in self.registers)
+        self.saved_regs = [] if self.current_scope() == 0 else \
+            [reg for reg in self.SAVED_REGS if reg in self.registers.values()]
+        scope["offset"] += 4 * len(self.saved_regs)
+
+    @staticmethod
+    def split_instruction(ins):  # "add t1,t1,t2" -> ("add", ["t1", "t1", "t2"])
+        op, _, args = ins.partition(" ")
+        return op, args.split(",") if args else []
+
+    @staticmethod
+    def base_register(arg):  # "-12(sp)" -> "sp"
+        return arg[arg.index("(") + 1:-1] if arg.endswith(")") else arg
+
+    def reads(self, op, args):
+        if op == "ecall":
+            return {"a0", "a7"}
+        return {self.base_register(a) for a in (args[1:] if op in self.WRITE_OPS else args)}
+
+    def is_dead(self, reg, asm):  # whether the scratch register reg is overwritten before being read in asm
+        for ins in asm:
+            if ins.endswith(":"):
+                return True
+            op, args = self.split_instruction(ins)
+            if reg in self.reads(op, args):
+                return False
+            if op in self.JUMP_OPS or op == "jr" or (op in self.WRITE_OPS and args[0] == reg):
+                return True
+        return True
+
+    def optimize_asm(self, asm):  # peephole optimizations over the instructions of a block
+        targets = {ins.rsplit(",", 1)[-1].split(" ")[-1] for ins in asm if ins.split(" ")[0] in self.JUMP_OPS}
+        out = []
+        prev = None  # index in out of the previous instruction, unless a jump target has been emitted since
+        jump = None  # index in out of the previous instruction, if it's a jump and only labels follow it
+        unreachable = False  # after j or jr, until a label that is jumped to
+
+        for i, ins in enumerate(asm):
+            if ins.endswith(":"):
+                label = ins[:-1]
+                if jump is not None and out[jump] == "j " + label:
+                    del out[jump]
+                    self.peephole_stats["jump to next"] += 1
+                    jump = None
+                if label in targets or not label.startswith("L_"):  # subprogram labels are jumped to by jal
+                    prev, unreachable = None, False
+                out.append(ins)
+                continue
+
+            if unreachable:  # e.g. the epilogue of end_block right after the one of retv
+                self.peephole_stats["unreachable"] += 1
+                continue
+
+            op, args = self.split_instruction(ins)
+            if prev is not None:
+                p_op, p_args = self.split_instruction(out[prev])
+                # sw/lw r1,M followed by lw r2,M, the value of M is already in r1
+                if op == "lw" and p_op in ("sw", "lw") and p_args[1] == args[1] and \
+                        (p_op == "sw" or self.base_register(p_args[1]) != p_args[0]):
+                    self.peephole_stats["load after store"] += 1
+                    if args[0] == p_args[0]:
+                        continue
+                    op, args = "mv", [args[0], p_args[0]]
+                    ins = "mv %s,%s" % (args[0], args[1])
+
+                # li/lw/add... t1,.. followed by mv r,t1, the instruction can write r directly
+                if op == "mv" and p_op in self.WRITE_OPS and p_args[0] == args[1] and \
+                        args[1] in self.SCRATCH_REGS and self.is_dead(args[1], asm[i + 1:]):
+                    self.peephole_stats["dead move"] += 1
+                    out[prev] = "%s %s" % (p_op, ",".join([args[0]] + p_args[1:]))
+                    continue
+
+            if op == "mv" and args[0] == args[1]:
+                self.peephole_stats["dead move"] += 1
+                continue
+
+            out.append(ins)
+            prev = len(out) - 1
+            jump = prev if op == "j" else None
+            unreachable = op in ("j", "jr")
+
+        return [ins for ins in out if not (ins.startswith("L_") and ins[:-1] not in targets)]  # unused labels
+
     def gen_asm_equivalent(self):
+        symbols = [".eqv %s, %d" % (symbol, ent["framelength"]) for symbol, ent in self.symbols.items()]
+        display = ["display: .space %d" % (4 * self.display_levels)] if self.display_levels else []
         return "\n".join(x if x.endswith(":") else "\t" + x for x in
-                         [".data", "str_nl: .asciiz \"\\n\"", ".text",
-                          ".global __start", "__start:", "j Lmain"] + self.statements)
+                         symbols + [".data"] + display + ["str_nl: .asciiz \"\\n\"", ".text",
+                                                          ".global __start", "__start:", "j Lmain"] + self.statements)
+
+
+class CGenerator:
+    """
+    Generates the C equivalent of a program, with a C function for every subprogram. The operands of every block are
+    resolved to C expressions while its scope is alive. Main's variables that nested subprograms access are globals,
+    the ones of other subprograms are kept in a _fr struct, which their nested subprograms reach through _up, the
+    pointer to the frame of their parent. inout parameters are pointers, and functions return their result.
+    """
+
+    def __init__(self, code_parser):
+        self.parser = code_parser
+        self.blocks = {}  # begin_block label -> resolved block
+
+    def resolve_block(self, start):  # resolves the block that starts at parser.quads[start]
+        st, quads = self.parser.st, self.parser.quads
+        scope = st.scopes[-1]
+        entities, level = scope["entities"], len(st.scopes) - 1
+        params = sorted(entities["parameters"].items(), key=lambda item: item[1]["offset"])
+        variables = [name for category in ("variables", "tmp_variables") for name in entities[category]]
+        nonlocal_vars = [name for name, ent in params if ent.get("nonlocal")] + \
+                        [name for name in variables if entities["variables"].get(name, {}).get("nonlocal")]
+        has_nested = bool(entities["functions"] or entities["procedures"])
+
+        block = {"level": level, "params": [(name, ent.get("mode") == "inout") for name, ent in params],
+                 "entity": None, "parent": None, "exprs": {}, "calls": {},
+                 "globals": nonlocal_vars if level == 0 else [], "temps": list(entities["tmp_variables"]),
+                 "frame": [(name, entities["parameters"].get(name, {}).get("mode") == "inout")
+                           for name in nonlocal_vars] if level > 0 and has_nested else None}
+        in_frame = {name for name, _ in block["frame"] or []}
+        block["locals"] = [name for name in variables if name not in in_frame and name not in block["globals"]]
+        if level > 0:
+            block["entity"] = self.parser.asm_generator.current_entity()
+            if level > 1:
+                parent = st.scopes[-2]["name"]
+                block["parent"] = st.scopes[-3]["entities"]["functions"].get(parent) or \
+                    st.scopes[-3]["entities"]["procedures"].get(parent)
+
+        for q in quads[start:]:
+            if q.op == "call":
+                ent = st.find_entity(q.x, categories=("functions", "procedures"))
+                block["calls"][q.label] = (ent, self.frame_of(ent["scope"], level))
+                continue
+            if q.op in ("begin_block", "end_block"):
+                continue
+            for v in (q.x, q.y, q.z):
+                if v and v not in block["exprs"] and not Optimizer.is_const(v):
+                    ent = st.find_entity(v, categories=("variables", "tmp_variables", "parameters"))
+                    if ent is not None:
+                        block["exprs"][v] = self.variable(v, ent, level, v in in_frame)
+        self.blocks[quads[start].label] = block
+
+    @staticmethod
+    def frame_of(scope, level):  # pointer to the frame of an enclosing scope, None for main's globals
+        if scope == 0:
+            return None
+        return "&_fr" if scope == level else "_up" + "->_up" * (level - 1 - scope)
+
+    def variable(self, name, ent, level, in_frame):  # (value, address) expressions of a variable
+        if ent["scope"] == level:
+            base = "_fr." + name if in_frame else name
+        elif ent["scope"] == 0:
+            base = name
+        else:
+            base = self.frame_of(ent["scope"], level) + "->" + name
+        if ent.get("mode") == "inout":
+            return "(*%s)" % base, base
+        return base, "&" + base
+
+    @staticmethod
+    def function_name(ent):
+        return ent["label"]
+
+    @staticmethod
+    def declarations(block, inline=()):  # inline: temporaries that are declared where they are assigned
+        names = [name for name in block["locals"] if name not in inline]
+        return ["int %s;" % ", ".join(names)] if names else []
+
+    def signature(self, block):
+        params = ["struct F_%s *_up" % self.function_name(block["parent"])] if block["parent"] else []
+        params += ["int %s%s" % ("*" if inout else "", name) for name, inout in block["params"]]
+        return "int %s(%s)" % (self.function_name(block["entity"]), ", ".join(params) or "void")
+
+    def frame_struct(self, block):
+        up = "struct F_%s" % self.function_name(block["parent"]) if block["parent"] else "void"
+        fields = ["%s *_up;" % up] + ["int %s%s;" % ("*" if inout else "", name) for name, inout in block["frame"]]
+        return "struct F_%s {\n%s\n};" % (self.function_name(block["entity"]), "\n".join("\t" + f for f in fields))
+
+    def prologue(self, block):
+        if block["frame"] is None:
+            return []
+        params = {name for name, _ in block["params"]}
+        return ["struct F_%s _fr;" % self.function_name(block["entity"]),
+                "_fr._up = %s;" % ("_up" if block["parent"] else "0")] + \
+               ["_fr.%s = %s;" % (name, name) for name, _ in block["frame"] if name in params]
+
+    @staticmethod
+    def c_expr(block):  # operand -> the C expression of its value
+        exprs = block["exprs"]
+        return lambda v: exprs[v][0] if v in exprs else v
+
+    def quad_to_c(self, q, block, pars):
+        exprs, c_expr = block["exprs"], self.c_expr(block)
+        if q.op == "par":
+            pars.append((q, exprs[q.x][1] if q.y == "REF" else c_expr(q.x)))
+            return ""
+        if q.op == "call":
+            ent, up = block["calls"][q.label]
+            args = ([up] if up else []) + [c for par, c in pars if par.y != "RET"]
+            call = "%s(%s)" % (self.function_name(ent), ", ".join(args))
+            ret = [c for par, c in pars if par.y == "RET"]
+            pars.clear()
+            return "%s = %s" % (ret[0], call) if ret else call
+        if q.op == "retv":
+            return "return %s" % c_expr(q.x)
+        if q.op == "end_block" and block["level"] > 0:
+            return "return 0"
+        return Quad(q.label, q.op, c_expr(q.x), c_expr(q.y), c_expr(q.z)).to_c()
+
+    def body(self, block, quads):
+        pars = []
+        return "".join(f"// {str(q)}\n{q.label}:\t {self.quad_to_c(q, block, pars)};\n" for q in quads)
+
+    def function(self, block, quads, structured):  # declarations and body
+        if not structured:
+            return "".join(line + "\n" for line in self.declarations(block) + self.prologue(block)), \
+                self.body(block, quads)
+        structurer = CStructurer(self, block, quads)
+        body = structurer.lines()
+        return "".join(line + "\n" for line in self.declarations(block, structurer.inline) + self.prologue(block)), \
+            "".join(line + "\n" for line in body)
+
+    def gen_c_equivalent(self, structured=False):
+        regions, start = [], 0
+        for i, q in enumerate(self.parser.quads):
+            if q.op == "begin_block":
+                start = i
+            elif q.op == "end_block":
+                regions.append((self.blocks[self.parser.quads[start].label], self.parser.quads[start:i + 1]))
+
+        subprograms = [(block, quads) for block, quads in regions if block["level"] > 0]
+        main_block, main_quads = regions[-1]
+        frames = [block for block, _ in subprograms if block["frame"] is not None]
+
+        out = ["#include <stdlib.h>", "#include <stdio.h>"]
+        out += ["struct F_%s;" % self.function_name(block["entity"]) for block in frames]
+        out += [self.frame_struct(block) for block in frames]
+        out += ["int %s;" % ", ".join(main_block["globals"])] if main_block["globals"] else []
+        out += [self.signature(block) + ";" for block, _ in subprograms]
+        for block, quads in subprograms:
+            decls, body = self.function(block, quads, structured)
+            out.append("%s {\n%s%s}" % (self.signature(block), decls, body))
+        decls, body = self.function(main_block, main_quads, structured)
+        body += "" if structured else "\nreturn 0;\n"  # the structured code returns at the halt quad
+        out.append(f"int main() {{\n{decls + body}}}")
+        return "\n".join(out)
+
+
+class CStructurer:
+    """
+    Rebuilds the structure of the C code of a block from its control flow graph, so it reads (and is optimized by a
+    C compiler) like the cimple source, instead of one goto per quad. Basic blocks are placed along the dominator
+    tree: loop headers open a for (;;), the successors of a branch that only it reaches are nested in the arms of an
+    if, and blocks that are reached from more than one place follow the code of their immediate dominator. The jumps
+    that are left become continue, break or, when neither one reaches their target, goto. A for (;;) that starts
+    with its exit test becomes a while, and an else arm that is a single if becomes an else if. Temporaries that
+    are only used in a single basic block are declared where they are assigned.
+    """
+
+    NEGATED = {"=": "<>", "<>": "=", "<": ">=", ">": "<=", "<=": ">", ">=": "<"}
+    JUMPS = ("return", "continue;", "break;", "goto ")
+    C_OPS = {"<>": "!=", "=": "=="}
+
+    def __init__(self, c_generator, block, quads):
+        self.generator = c_generator
+        self.block = block
+        self.cfg = ControlFlowGraph(quads)
+        self.rpo = {b: i for i, b in enumerate(self.cfg.order)}
+        self.children = {b: [] for b in self.cfg.order}  # dominator tree
+        for b in self.cfg.order[1:]:
+            idom = max((d for d in self.cfg.dominators[b] if d is not b), key=self.rpo.get)
+            self.children[idom].append(b)
+        self.merges = {b for b in self.cfg.order  # reached by more than one forward edge
+                       if sum(p in self.rpo and self.rpo[p] < self.rpo[b] for p in b.preds) > 1}
+        self.loops = self.cfg.loops()  # header -> the blocks of its loop
+        self.exits = set()  # blocks that are placed after a loop, which the loop reaches through break or goto
+        self.inline = self.block_local_temps()
+        self.declared = set()
+        self.gotos = set()  # blocks that are the target of a goto, they need a label
+        self.conditions = {}  # if line -> its negated condition
+        self.pars = []
+
+    def block_local_temps(self):
+        used, defs = {}, {}  # temporary -> the basic blocks that use it, the quads that assign it
+        for b in self.cfg.blocks:
+            for q in b.quads:
+                for v in (q.x, q.y, q.z):
+                    if v in self.block["temps"]:
+                        used.setdefault(v, set()).add(b)
+                t = self.assigned(q)
+                if t in self.block["temps"]:
+                    defs.setdefault(t, []).append(q)
+        inline = set()
+        for t, b in ((t, next(iter(bs))) for t, bs in used.items() if len(bs) == 1 and len(defs.get(t, ())) == 1):
+            first = next(q for q in b.quads if t in (q.x, q.y, q.z))
+            if first is defs[t][0] and (first.op == "par" or t not in (first.x, first.y)):
+                inline.add(t)
+        return inline
+
+    @staticmethod
+    def assigned(q):  # the variable that a quad assigns, the RET temporary is assigned by the following call
+        if q.op in ("+", "-", "*", "/", ":="):
+            return q.z
+        return q.x if q.op == "par" and q.y == "RET" else None
+
+    def lines(self):
+        out = []
+        self.do_tree(self.cfg.order[0], None, [], out, "")
+        return self.polish([line[:-1] if line.endswith("@") else line for line in out
+                            if not line.endswith("@") or line.strip()[:-3] in self.gotos])
+
+    def label(self, b):
+        return b.quads[0].label
+
+    def by_rpo(self, blocks):  # the last ones first, they are placed after the others
+        return sorted(blocks, key=self.rpo.get, reverse=True)
+
+    def do_tree(self, x, follow, ctx, out, indent):
+        out.append(indent + self.label(x) + ":;@")  # kept if there is a goto to it
+        if x not in self.loops:
+            merges = self.by_rpo(c for c in self.children[x] if c in self.merges)
+            return self.followed_by(merges, follow, ctx, out, indent,
+                                    lambda f: self.node_within(x, f, ctx, out, indent))
+
+        body = self.loops[x]
+        exits = self.by_rpo(c for c in self.children[x] if c not in body)
+        merges = self.by_rpo(c for c in self.children[x] if c in body and c in self.merges)
+        self.exits.update(exits)
+
+        def loop(after):
+            lines = []
+            self.followed_by(merges, x, ctx + [(x, after)], lines, indent + "\t",
+                             lambda f: self.node_within(x, f, ctx + [(x, after)], lines, indent + "\t"))
+            out.append(indent + "for (;;) {")
+            out.extend(lines)
+            out.append(indent + "}")
+
+        self.followed_by(exits, follow, ctx, out, indent, loop)
+
+    def followed_by(self, blocks, follow, ctx, out, indent, emit):  # emit(follow) and then the blocks, in order
+        if not blocks:
+            return emit(follow)
+        self.followed_by(blocks[1:], blocks[0], ctx, out, indent, emit)
+        self.do_tree(blocks[0], follow, ctx, out, indent)
+
+    def node_within(self, x, follow, ctx, out, indent):  # follow: the block that runs after this code
+        last = x.quads[-1]
+        for q in x.quads if last.op != "jump" and last.op not in REL_OPS else x.quads[:-1]:
+            stmt = self.generator.quad_to_c(q, self.block, self.pars)
+            name = stmt.split(" = ")[0]
+            if name in self.inline and name not in self.declared:
+                self.declared.add(name)
+                stmt = "int " + stmt
+            if stmt:
+                out.append(indent + stmt + ";")
+
+        if last.op in ControlFlowGraph.TERMINAL_OPS:
+            return out.append(indent + "return 0;") if last.op == "halt" else None
+        if last.op == "jump":
+            return self.branch(x, self.cfg.block_of[last.z], follow, ctx, out, indent)
+        fallthrough = self.cfg.blocks[x.index + 1]
+        if last.op not in REL_OPS or self.cfg.block_of[last.z] is fallthrough:
+            return self.branch(x, fallthrough, follow, ctx, out, indent)
+
+        then_lines, else_lines = [], []
+        self.branch(x, self.cfg.block_of[last.z], follow, ctx, then_lines, indent + "\t")
+        self.branch(x, fallthrough, follow, ctx, else_lines, indent + "\t")
+        op = last.op
+        if not then_lines or self.is_jump(else_lines, indent) and not self.is_jump(then_lines, indent) or \
+                not self.is_jump(then_lines, indent) and self.is_if(then_lines) and not self.is_if(else_lines):
+            then_lines, else_lines, op = else_lines, then_lines, self.NEGATED[op]
+        if not then_lines:
+            return
+        c_expr = self.generator.c_expr(self.block)
+        condition = "%s %s %s" % (c_expr(last.x), self.C_OPS.get(op, op), c_expr(last.y))
+        self.conditions[indent + "if (%s) {" % condition] = "%s %s %s" % (
+            c_expr(last.x), self.C_OPS.get(self.NEGATED[op], self.NEGATED[op]), c_expr(last.y))
+        out.append(indent + "if (%s) {" % condition)
+        out += then_lines
+        if else_lines and self.is_jump(then_lines, indent):  # no else after a jump
+            out += [indent + "}"] + [line[1:] for line in else_lines]
+        else:
+            out += ([indent + "} else {"] + else_lines if else_lines else []) + [indent + "}"]
+
+    @staticmethod
+    def closing(lines, i):  # index of the } that closes the statement that starts at lines[i]
+        indent = lines[i][:len(lines[i]) - len(lines[i].lstrip("\t"))]
+        return next(k for k in range(i + 1, len(lines)) if lines[k] == indent + "}")
+
+    def polish(self, lines):  # for (;;) { if (c) { break; } ... } -> while (!c) { ... }, else { if -> else if
+        for i, line in enumerate(lines):
+            indent = line and line[:len(line) - len(line.lstrip("\t"))]
+            if line and line == indent + "for (;;) {" and lines[i + 1] in self.conditions and \
+                    lines[i + 2:i + 4] == [indent + "\t\tbreak;", indent + "\t}"]:
+                lines[i:i + 4] = [indent + "while (%s) {" % self.conditions[lines[i + 1]], None, None, None]
+        lines = [line for line in lines if line is not None]
+
+        i = 0
+        while i < len(lines):
+            indent = lines[i][:len(lines[i]) - len(lines[i].lstrip("\t"))]
+            if lines[i] == indent + "} else {" and lines[i + 1].startswith(indent + "\tif ("):
+                end = self.closing(lines, i)
+                if self.closing(lines, i + 1) == end - 1:
+                    lines[i:end + 1] = [indent + "} else " + lines[i + 1].lstrip("\t")] + \
+                                       [line[1:] for line in lines[i + 2:end]]
+            i += 1
+        return lines
+
+    def is_if(self, lines):  # the arm is a single if statement, so as an else arm it becomes an else if
+        lines = [line for line in lines if not line.endswith("@")]
+        return bool(lines) and lines[0].lstrip("\t").startswith("if (") and self.closing(lines, 0) == len(lines) - 1
+
+    def is_jump(self, lines, indent):  # the arm of an if at indent ends with a jump
+        return bool(lines) and lines[-1].startswith(tuple(indent + "\t" + jump for jump in self.JUMPS))
+
+    def branch(self, x, target, follow, ctx, out, indent):
+        loop, after = ctx[-1] if ctx else (None, None)  # the innermost loop and the block after it
+        if target is follow:
+            return
+        if self.rpo[target] <= self.rpo[x]:  # back to a loop header
+            if target is loop:
+                return out.append(indent + "continue;")
+        elif target not in self.merges and target not in self.exits:
+            return self.do_tree(target, follow, ctx, out, indent)
+        elif target is after:
+            return out.append(indent + "break;")
+        self.gotos.add(self.label(target))
+        out.append(indent + "goto %s;" % self.label(target))
 
 
 class SymbolTable:
     def __init__(self, code_parser):
         self.parser = code_parser
         self.scopes = []
+        self.symbols = {}  # name -> stack of (category, entity) declarations, innermost last
 
     def assert_declared(self, name, categories):
-        if self.parser.st.find_entity(name, categories) is None:
+        if self.find_entity(name, categories) is None:
             raise CompilationError("Symbol '%s' does not belong to %s." % (name, " or ".join(categories)),
-                                   self.parser.tokens[self.parser.token_idx].cursor, self.parser.lines)
+                                   self.parser.peek().cursor, self.parser.lines)
 
     def create_scope(self, name=""):
         self.scopes.append({"name": name, "offset": 12, "entities": {
             "variables": {}, "tmp_variables": {}, "functions": {}, "procedures": {}, "parameters": {}}})
 
+    def pop_scope(self):
+        scope = self.scopes.pop()
+        for entities in scope["entities"].values():
+            for name in entities:
+                shadowed = self.symbols[name]
+                shadowed.pop()
+                if not shadowed:
+                    del self.symbols[name]
+        return scope
+
     def add_new_entity(self, category, name, entity):
-        if self.parser.st.find_entity(name, max_depth=1):
+        if self.find_entity(name, max_depth=1):
             raise CompilationError("Symbol '%s' is already declared in the same scope." % name,
-                                   self.parser.tokens[self.parser.token_idx].cursor, self.parser.lines)
+                                   self.parser.peek().cursor, self.parser.lines)
 
         if category in ("variables", "parameters", "tmp_variables"):
             entity["offset"] = self.scopes[-1]["offset"]
@@ -152,33 +831,968 @@ class SymbolTable:
 
         entity["scope"] = len(self.scopes) - 1
         self.scopes[-1]["entities"][category][name] = entity
+        self.symbols.setdefault(name, []).append((category, entity))
 
     def find_entity(self, name, categories=("variables", "functions", "parameters", "procedures", "tmp_variables"),
                     max_depth=None):
-        for scope in self.scopes[::-1][:max_depth if max_depth is not None else len(self.scopes)]:
-            for cat in categories:
-                if name in scope["entities"][cat]:
-                    return scope["entities"][cat][name]
+        # a name is declared at most once per scope, so its declarations stack up from the outermost scope inwards
+        min_scope = 0 if max_depth is None else len(self.scopes) - max_depth
+        for category, entity in reversed(self.symbols.get(name, ())):
+            if entity["scope"] < min_scope:
+                return None
+            if category in categories:
+                return entity
         return None
 
 
+class BasicBlock:
+    def __init__(self, index, quads):
+        self.index = index
+        self.quads = quads
+        self.succs = []
+        self.preds = []
+
+    def __repr__(self):
+        return "B%d(%s..%s)" % (self.index, self.quads[0].label, self.quads[-1].label)
+
+
+class ControlFlowGraph:
+    """
+    Basic blocks of the quads of a begin_block ... end_block region, with their successor and predecessor edges and
+    dominators. The blocks hold the quads themselves, and in the same order, so changes to them are seen through both
+    views, but adding, removing or retargeting quads needs a new graph.
+    """
+
+    TERMINAL_OPS = {"retv", "halt", "end_block"}
+
+    def __init__(self, quads):
+        self.quads = quads
+        self.blocks = []
+        self.block_of = {}  # quad label -> the basic block that contains it
+
+        targets = {q.z for q in quads if q.op == "jump" or q.op in REL_OPS}
+        start = 0
+        for i, q in enumerate(quads):
+            if i + 1 == len(quads) or quads[i + 1].label in targets or q.op == "jump" or q.op in REL_OPS or \
+                    q.op in self.TERMINAL_OPS:
+                self.blocks.append(BasicBlock(len(self.blocks), quads[start:i + 1]))
+                start = i + 1
+        for block in self.blocks:
+            for q in block.quads:
+                self.block_of[q.label] = block
+
+        for block in self.blocks:
+            last = block.quads[-1]
+            if last.op == "jump" or last.op in REL_OPS:
+                block.succs.append(self.block_of[last.z])
+            if last.op != "jump" and last.op not in self.TERMINAL_OPS and block.index + 1 < len(self.blocks):
+                next_block = self.blocks[block.index + 1]
+                if next_block not in block.succs:  # a branch to the next quad
+                    block.succs.append(next_block)
+            for succ in block.succs:
+                succ.preds.append(block)
+
+        self.order = self.reverse_postorder()  # the blocks that are reachable from the entry
+        self.dominators = self.find_dominators()  # block -> the set of blocks that dominate it
+
+    @staticmethod
+    def regions(quads):  # one graph for each begin_block ... end_block, nested blocks end before their parent begins
+        graphs, start = [], 0
+        for i, q in enumerate(quads):
+            if q.op == "begin_block":
+                start = i
+            elif q.op == "end_block":
+                graphs.append(ControlFlowGraph(quads[start:i + 1]))
+        return graphs
+
+    def reverse_postorder(self):
+        order, visited, stack = [], {self.blocks[0]}, [(self.blocks[0], iter(self.blocks[0].succs))]
+        while stack:
+            block, succs = stack[-1]
+            succ = next((s for s in succs if s not in visited), None)
+            if succ is None:
+                order.append(block)
+                stack.pop()
+            else:
+                visited.add(succ)
+                stack.append((succ, iter(succ.succs)))
+        return order[::-1]
+
+    def find_dominators(self):
+        entry, reachable = self.order[0], set(self.order)
+        dominators = {b: set(reachable) for b in self.order}
+        dominators[entry] = {entry}
+
+        changed = True
+        while changed:
+            changed = False
+            for block in self.order[1:]:
+                new = set.intersection(*(dominators[p] for p in block.preds if p in reachable)) | {block}
+                if new != dominators[block]:
+                    dominators[block], changed = new, True
+        return dominators
+
+    def dominates(self, a, b):
+        return a in self.dominators.get(b, ())
+
+    def loops(self):  # header -> blocks of the natural loop, for the back edges to a block that dominates their source
+        loops = {}
+        for block in self.order:
+            for header in block.succs:
+                if not self.dominates(header, block):
+                    continue
+                body, pending = loops.setdefault(header, {header}), [block]
+                while pending:
+                    b = pending.pop()
+                    if b not in body:
+                        body.add(b)
+                        pending += b.preds
+        return loops
+
+
+class Optimizer:
+    NEGATED_REL_OPS = {"=": "<>", "<>": "=", "<": ">=", ">=": "<", ">": "<=", "<=": ">"}
+
+    def __init__(self, code_parser, inline_threshold=0):
+        self.parser = code_parser
+        self.inline_threshold = inline_threshold  # subprograms of at most this many quads are inlined
+        self.inline_seq = 0
+        self.stats = {"inlined calls": 0, "tail recursions": 0, "common subexpressions": 0, "unreachable": 0,
+                      "dead stores": 0, "uncalled subprograms": 0, "loop invariants": 0, "induction variables": 0}
+
+    def optimize_block(self, start):  # optimizes the quads of the block that starts at parser.quads[start]
+        quads = self.parser.quads[start:]
+        if self.inline_threshold:
+            quads = self.inline_calls(quads)
+        quads = self.eliminate_tail_recursion(quads)
+        quads = self.fold_constants(quads)
+        quads = self.eliminate_common_subexpressions(quads)
+        quads = self.simplify_jumps(quads)
+        quads = self.eliminate_dead_code(quads)
+        quads = self.simplify_jumps(quads)
+        quads = self.hoist_loop_invariants(quads)
+        quads = self.reduce_induction_variables(quads)
+        self.reuse_temp_slots(quads, ControlFlowGraph(quads))
+        if self.inline_threshold and len(self.parser.st.scopes) > 1:
+            self.save_for_inlining(quads)
+        self.parser.quads[start:] = quads
+
+    @staticmethod
+    def names(q):  # the variables, or the subprogram, that the quad refers to
+        if q.op in ("+", "-", "*", "/", ":="):
+            fields = q.x, q.y, q.z
+        elif q.op in REL_OPS:
+            fields = q.x, q.y
+        elif q.op in ("out", "inp", "retv", "par", "call"):
+            fields = q.x,
+        else:
+            fields = ()
+        return [v for v in fields if v and not Optimizer.is_const(v)]
+
+    def find_name(self, name, is_call):
+        return self.parser.st.find_entity(name, categories=("functions", "procedures") if is_call else
+                                          ("variables", "tmp_variables", "parameters"))
+
+    def save_for_inlining(self, quads):  # keeps a copy of the quads of a small subprogram, to inline its calls
+        scope = self.parser.st.scopes[-1]
+        entities = scope["entities"]
+        body = quads[1:-1]
+        if len(body) > self.inline_threshold or entities["functions"] or entities["procedures"]:
+            return  # nested subprograms need the frame of their parent
+
+        own = {name for cat in ("parameters", "variables", "tmp_variables") for name in entities[cat]}
+        free = {(v, q.op == "call"): self.find_name(v, q.op == "call")
+                for q in body for v in self.names(q) if v not in own}
+        ent = self.parser.asm_generator.current_entity()
+        if free.get((scope["name"], True)) is ent:
+            return  # recursive
+
+        ent["inline"] = {"quads": [Quad(q.label, q.op, q.x, q.y, q.z) for q in body], "end": quads[-1].label,
+                         "free": free, "parameters": [(name, p["mode"]) for name, p in entities["parameters"].items()],
+                         "variables": list(entities["variables"]), "temps": list(entities["tmp_variables"])}
+
+    def inline_calls(self, quads):  # replaces calls to the subprograms that were saved for inlining with their quads
+        for call in [q for q in quads if q.op == "call"]:
+            info = self.find_name(call.x, True).get("inline")
+            if info is None or any(self.find_name(name, is_call) is not ent
+                                   for (name, is_call), ent in info["free"].items()):
+                continue  # a name of the subprogram means something else here
+
+            end = quads.index(call)
+            start = end
+            while start > 0 and quads[start - 1].op == "par":
+                start -= 1
+            pars = quads[start:end]
+            ret = next((p.x for p in pars if p.y == "RET"), None)
+            args = [p for p in pars if p.y != "RET"]
+            after = quads[end + 1].label
+
+            self.inline_seq += 1
+            names, inlined = {}, []
+            for (name, mode), par in zip(info["parameters"], args):
+                if mode == "inout":  # the parameter becomes the variable it refers to
+                    names[name] = par.x
+                else:
+                    names[name] = self.new_variable(name)
+                    inlined.append(self.new_quad(":=", par.x, "", names[name]))
+            for name in info["variables"]:
+                names[name] = self.new_variable(name)
+            for name in info["temps"]:
+                names[name] = self.parser.new_temp()
+
+            labels = {info["end"]: after}
+            body = []
+            for q in info["quads"]:
+                new = self.new_quad(q.op, q.x, q.y, q.z)
+                labels[q.label] = new.label
+                for field in ("x", "y", "z"):
+                    if getattr(q, field) in self.names(q):
+                        setattr(new, field, names.get(getattr(q, field), getattr(q, field)))
+                if q.op == "retv":  # the result is written to the RET temporary, instead of returning
+                    new.op, new.x, new.z = (":=", new.x, ret) if ret else ("jump", "", after)
+                    body.append(new)
+                    new = self.new_quad("jump", "", "", after)
+                body.append(new)
+            for q in body:
+                if q.op == "jump" or q.op in REL_OPS:
+                    q.z = labels.get(q.z, q.z)
+            inlined += body
+
+            removed = {q.label for q in quads[start:end + 1]}
+            quads[start:end + 1] = inlined
+            for q in quads:
+                if (q.op == "jump" or q.op in REL_OPS) and q.z in removed:
+                    q.z = inlined[0].label if inlined else after
+            self.stats["inlined calls"] += 1
+        return quads
+
+    def eliminate_tail_recursion(self, quads):  # a call to itself that is returned right away, jumps to the start
+        if len(self.parser.st.scopes) == 1:
+            return quads
+        ent = self.parser.asm_generator.current_entity()
+        params = list(self.parser.st.scopes[-1]["entities"]["parameters"].items())
+        by_label = {q.label: q for q in quads}
+
+        for end in reversed(range(len(quads))):  # backwards, so replacing the calls doesn't move the ones before
+            call = quads[end]
+            if call.op != "call" or self.find_name(call.x, True) is not ent:
+                continue
+            start = end
+            while quads[start - 1].op == "par":
+                start -= 1
+            ret = quads[end - 1].x if quads[end - 1].y == "RET" else None
+            after = quads[end + 1]
+            while after.op == "jump":  # e.g. to the end of an if statement
+                after = by_label[after.z]
+            if not (after.op == "retv" and ret is not None and after.x == ret or after.op == "end_block"):
+                continue
+            args = [p for p in quads[start:end] if p.y != "RET"]
+            if any((par.y == "REF") != (p["mode"] == "inout") or par.y == "REF" and par.x != name
+                   for (name, p), par in zip(params, args)):
+                continue  # the references can only be passed on unchanged
+
+            # the arguments may read parameters that are assigned before them
+            temps = [(self.parser.new_temp(), name, par) for (name, p), par in zip(params, args) if par.y == "CV"]
+            quads[start:end + 1] = [self.new_quad(":=", par.x, "", t) for t, name, par in temps] + \
+                                   [self.new_quad(":=", t, "", name) for t, name, par in temps] + \
+                                   [self.new_quad("jump", "", "", quads[1].label)]
+            self.stats["tail recursions"] += 1
+        return quads
+
+    def new_variable(self, name):  # a variable of an inlined subprogram, "_" can't be part of the program's names
+        name = "%s_i%d" % (name, self.inline_seq)
+        self.parser.st.add_new_entity(category="variables", name=name, entity={})
+        return name
+
+    @staticmethod
+    def is_const(v):
+        return v.lstrip("-").isdigit()
+
+    @staticmethod
+    def wrap32(v):  # values wrap around like in the 32bit RISC-V registers
+        return (v + 2 ** 31) % 2 ** 32 - 2 ** 31
+
+    @staticmethod
+    def jump_targets(quads):
+        return {q.z for q in quads if q.op == "jump" or q.op in REL_OPS}
+
+    def is_tracked(self, name):  # only temporaries and locals of the current block cannot be changed behind our back
+        ent = self.parser.st.find_entity(name, categories=("variables", "tmp_variables", "parameters"))
+        return ent is not None and ent["scope"] == len(self.parser.st.scopes) - 1 and ent.get("mode") != "inout"
+
+    def is_local(self, name):  # tracked and not accessed by nested subprograms, no reads of it can be missed
+        return self.is_tracked(name) and not self.parser.st.find_entity(
+            name, categories=("variables", "tmp_variables", "parameters")).get("nonlocal")
+
+    def is_temp(self, name):
+        return self.parser.st.find_entity(name, categories=("tmp_variables",)) is not None
+
+    def eval_arithmetic(self, op, x, y):
+        x, y = self.wrap32(int(x)), self.wrap32(int(y))
+        if op == "+":
+            return self.wrap32(x + y)
+        elif op == "-":
+            return self.wrap32(x - y)
+        elif op == "*":
+            return self.wrap32(x * y)
+        elif y == 0:
+            return None  # keep division by zero as a runtime error
+        q = abs(x) // abs(y)  # division truncates towards zero
+        return self.wrap32(q if (x < 0) == (y < 0) else -q)
+
+    @staticmethod
+    def eval_relational(op, x, y):
+        x, y = Optimizer.wrap32(int(x)), Optimizer.wrap32(int(y))
+        return {"=": x == y, "<>": x != y, ">": x > y, "<": x < y, ">=": x >= y, "<=": x <= y}[op]
+
+    def fold_constants(self, quads):
+        targets = self.jump_targets(quads)
+        consts = {}  # name -> constant value, for the straight line code since the last jump target
+        dead = set()
+
+        for q in quads:
+            if q.label in targets:
+                consts = {}
+
+            if q.op in (":=", "out", "retv") or q.op == "par" and q.y == "CV":  # the y of par is its mode
+                q.x = consts.get(q.x, q.x)
+            elif q.op in ("+", "-", "*", "/") or q.op in REL_OPS:
+                q.x, q.y = consts.get(q.x, q.x), consts.get(q.y, q.y)
+
+            if q.op in ("+", "-", "*", "/") and self.is_const(q.x) and self.is_const(q.y):
+                v = self.eval_arithmetic(q.op, q.x, q.y)
+                if v is not None:
+                    q.op, q.x, q.y = ":=", str(v), ""
+            elif q.op in REL_OPS and self.is_const(q.x) and self.is_const(q.y):
+                if self.eval_relational(q.op, q.x, q.y):
+                    q.op, q.x, q.y = "jump", "", ""
+                else:
+                    dead.add(q)
+
+            if q.op in ("+", "-", "*", "/", ":="):
+                consts.pop(q.z, None)
+                if q.op == ":=" and self.is_const(q.x) and self.is_tracked(q.z):
+                    consts[q.z] = q.x
+            elif q.op == "inp":
+                consts.pop(q.x, None)
+            elif q.op == "call":  # the callee can change any non temporary variable and writes its RET temporary
+                consts = {k: v for k, v in consts.items() if self.is_temp(k)}
+            elif q.op == "par" and q.y == "RET":
+                consts.pop(q.x, None)
+
+        used = {v for q in quads if q not in dead for v in (q.x, q.y)}
+        dead |= {q for q in quads if q.op in ("+", "-", "*", ":=") and q.z not in used and self.is_temp(q.z)}
+        return self.remove_quads(quads, dead)
+
+    @staticmethod
+    def expression(q):  # operands of + and * are ordered, so that a + b and b + a are the same expression
+        return (q.op,) + ((min(q.x, q.y), max(q.x, q.y)) if q.op in ("+", "*") else (q.x, q.y))
+
+    def available_expressions(self, quads, available):  # (expression, temporary) pairs available after the quads
+        for q in quads:
+            for v in self.defs(q):
+                available = {(e, t) for e, t in available if t != v and v not in e[1:]}
+            if q.op == "call":  # the callee can change anything but the temporaries
+                available = {(e, t) for e, t in available if all(self.is_const(v) or self.is_temp(v) for v in e[1:])}
+            elif q.op in ("+", "-", "*", "/") and self.is_temp(q.z) and q.z not in (q.x, q.y) and \
+                    all(self.is_const(v) or self.is_temp(v) or self.is_local(v) for v in (q.x, q.y)):
+                available = available | {(self.expression(q), q.z)}
+        return available
+
+    def eliminate_common_subexpressions(self, quads):  # reuses the temporary of an expression that is available
+        cfg = ControlFlowGraph(quads)
+        available_in = {b: None for b in cfg.order}  # None until the block is first visited, it means everything
+        available_in[cfg.order[0]] = set()
+
+        changed = True
+        while changed:
+            changed = False
+            for block in cfg.order[1:]:
+                outs = [self.available_expressions(p.quads, available_in[p]) for p in block.preds
+                        if available_in.get(p) is not None]
+                new = set.intersection(*outs) if outs else None
+                if new != available_in[block]:
+                    available_in[block], changed = new, True
+
+        users, assignments = {}, {}  # temporary -> the quads that read it, and the number of quads that write it
+        for q in quads:
+            for v in self.uses(q):
+                users.setdefault(v, []).append(q)
+            for v in self.defs(q):
+                assignments[v] = assignments.get(v, 0) + 1
+
+        dead, removed = set(), set()  # removed: the temporaries of the dead quads
+        for block in cfg.order:
+            available = available_in[block] or set()
+            for i, q in enumerate(block.quads):
+                if q.op in ("+", "-", "*", "/") and self.is_temp(q.z) and assignments[q.z] == 1:
+                    t = next((t for e, t in available if e == self.expression(q) and t != q.z and t not in removed),
+                             None)
+                    if t is not None:
+                        self.stats["common subexpressions"] += 1
+                        if all(u in block.quads[i + 1:] for u in users.get(q.z, ())):  # t can't change in between
+                            for u in users.get(q.z, ()):
+                                u.x, u.y = (t if u.x == q.z else u.x), (t if u.y == q.z else u.y)
+                            dead.add(q)
+                            removed.add(q.z)
+                            continue
+                        q.op, q.x, q.y = ":=", t, ""
+                available = self.available_expressions([q], available)
+        return self.remove_quads(quads, dead)
+
+    def hoist_loop_invariants(self, quads):  # moves invariant arithmetic before the loop header, inner loops first
+        while True:
+            cfg = ControlFlowGraph(quads)
+            for header, body in sorted(cfg.loops().items(), key=lambda loop: len(loop[1])):
+                hoisted = self.loop_invariants(quads, cfg, header, body)
+                if hoisted:
+                    quads = self.hoist(quads, cfg, header, body, hoisted)
+                    self.stats["loop invariants"] += len(hoisted)
+                    break
+            else:
+                return quads
+
+    def loop_invariants(self, quads, cfg, header, body):
+        if header.index == 0 or cfg.blocks[header.index - 1] in body:
+            return []  # the loop is entered by falling through from the block before it, which becomes its preheader
+
+        loop_quads = [q for b in sorted(body, key=lambda b: b.index) for q in b.quads]
+        defined = {v for q in loop_quads for v in self.defs(q)} | \
+                  {q.x for q in loop_quads if q.op == "par" and q.y == "REF"}  # the callee writes them
+        def_count = {}
+        for q in quads:
+            for v in self.defs(q):
+                def_count[v] = def_count.get(v, 0) + 1
+        temps = {q.z for q in loop_quads if q.op in ("+", "-", "*", "/") and self.is_temp(q.z)}
+        live_at_entry = self.liveness(quads, temps, cfg)[quads.index(header.quads[0])]
+
+        hoisted, changed = [], True
+        while changed:
+            changed = False
+            invariant = {q.z for q in hoisted}
+            for q in loop_quads:
+                if q in hoisted or q.op not in ("+", "-", "*", "/") or not self.is_temp(q.z) or \
+                        def_count[q.z] != 1 or q.z in live_at_entry:
+                    continue
+                if q.op == "/" and (not self.is_const(q.y) or int(q.y) == 0):
+                    continue  # it may not be executed in the loop, keep division by zero as a runtime error
+                if all(self.is_const(v) or v in invariant or v not in defined and (self.is_temp(v) or self.is_local(v))
+                       for v in (q.x, q.y)):
+                    hoisted.append(q)
+                    changed = True
+        return hoisted
+
+    def hoist(self, quads, cfg, header, body, hoisted):  # the hoisted quads become the preheader of the loop
+        first = header.quads[0]
+        loop_quads = {q for b in body for q in b.quads}
+        entering = [q for q in quads if (q.op == "jump" or q.op in REL_OPS) and q.z == first.label and
+                    q not in loop_quads]
+        position = quads.index(first)
+        kept = next(q for q in quads[position:] if q not in hoisted)
+
+        quads = self.remove_quads(quads, set(hoisted))  # jumps to the hoisted quads go to the next kept quad
+        position = quads.index(kept)
+        quads[position:position] = hoisted
+        for q in entering:
+            q.z = hoisted[0].label
+        return quads
+
+    def reduce_induction_variables(self, quads):  # i * c in a loop that steps i, becomes a temporary stepped along
+        while True:
+            cfg = ControlFlowGraph(quads)
+            for header, body in sorted(cfg.loops().items(), key=lambda loop: len(loop[1])):
+                if header.index == 0 or cfg.blocks[header.index - 1] in body:
+                    continue  # there's no place for a preheader, like in loop_invariants
+                loop_quads = [q for b in sorted(body, key=lambda b: b.index) for q in b.quads]
+                steps = self.induction_variables(loop_quads)
+                for q in loop_quads:
+                    x, y = (q.y, q.x) if self.is_const(q.x) else (q.x, q.y)
+                    if q.op != "*" or x not in steps or not self.is_const(y) or self.is_power_of_two(int(y)):
+                        continue  # multiplications by powers of two become shifts anyway
+                    step, update = steps[x]
+                    # the temporary is assigned more than once, it's created after the passes that expect otherwise
+                    t = self.parser.new_temp()
+                    quads = self.hoist(quads, cfg, header, body, [self.new_quad("*", x, y, t)])
+                    quads.insert(quads.index(update) + 1, self.new_quad("+", t, str(self.wrap32(step * int(y))), t))
+                    q.op, q.x, q.y = ":=", t, ""
+                    self.stats["induction variables"] += 1
+                    break
+                else:
+                    continue
+                break
+            else:
+                return quads
+
+    def induction_variables(self, loop_quads):  # i -> (step, quad), for the locals that are only set by i := i + step
+        defs = {}
+        for q in loop_quads:
+            for v in self.defs(q):
+                defs.setdefault(v, []).append(q)
+            if q.op == "par" and q.y == "REF":
+                defs.setdefault(q.x, []).append(q)
+
+        steps = {}
+        for i, quads in defs.items():
+            if len(quads) != 1 or quads[0].op != ":=" or not self.is_local(i) or self.is_temp(i):
+                continue
+            step = defs.get(quads[0].x, [None])[0]
+            if step is None or len(defs[quads[0].x]) != 1 or step.op not in ("+", "-"):
+                continue
+            x, y = (step.y, step.x) if step.op == "+" and self.is_const(step.x) else (step.x, step.y)
+            if x == i and self.is_const(y):
+                steps[i] = (int(y) * (-1 if step.op == "-" else 1), quads[0])
+        return steps
+
+    def new_quad(self, op, x, y, z):
+        self.parser.quad_seq += 1
+        return Quad("L_%d" % self.parser.quad_seq, op, x, y, z)
+
+    @staticmethod
+    def is_power_of_two(v):
+        return v > 0 and v & (v - 1) == 0
+
+    def simplify_jumps(self, quads):
+        while True:
+            by_label = {q.label: q for q in quads}
+            for q in quads:  # jumps to a jump go straight to its target
+                seen = {q.label}
+                while (q.op == "jump" or q.op in REL_OPS) and by_label[q.z].op == "jump" and q.z not in seen:
+                    seen.add(q.z)
+                    q.z = by_label[q.z].z
+
+            targets = self.jump_targets(quads)
+            dead = set()
+            for i, q in enumerate(quads[:-1]):
+                if q in dead or not (q.op == "jump" or q.op in REL_OPS):
+                    continue
+                if q.z == quads[i + 1].label:  # jump to the next quad
+                    dead.add(q)
+                elif q.op in REL_OPS and i + 2 < len(quads) and quads[i + 1].op == "jump" and \
+                        quads[i + 1].label not in targets and q.z == quads[i + 2].label:
+                    # if cond goto L2; goto L1; L2: ... becomes if not cond goto L1; L2: ...
+                    q.op, q.z = self.NEGATED_REL_OPS[q.op], quads[i + 1].z
+                    dead.add(quads[i + 1])
+
+            if not dead:
+                return quads
+            quads = self.remove_quads(quads, dead)
+
+    def eliminate_dead_code(self, quads):
+        while True:
+            cfg = ControlFlowGraph(quads)
+            reachable = set(cfg.order)
+            dead = {q for b in cfg.blocks if b not in reachable
+                    for q in b.quads if q.op not in ("begin_block", "end_block")}
+            self.stats["unreachable"] += len(dead)
+            if not dead:
+                dead = self.dead_stores(quads, cfg)
+                self.stats["dead stores"] += len(dead)
+            if not dead:
+                return quads
+            quads = self.remove_quads(quads, dead)
+
+    def dead_stores(self, quads, cfg):  # assignments to locals and temporaries that are not read afterwards
+        names = {q.z for q in quads if q.op in ("+", "-", "*", "/", ":=") and self.is_local(q.z)}
+        live_in = dict(zip(quads, self.liveness(quads, names, cfg)))
+
+        dead = set()
+        for block in cfg.blocks:
+            for i, q in enumerate(block.quads):
+                if q.z not in names or q.op not in ("+", "-", "*", "/", ":="):
+                    continue
+                if q.op == "/" and (not self.is_const(q.y) or int(q.y) == 0):
+                    continue  # keep division by zero as a runtime error
+                if i + 1 < len(block.quads):
+                    live_out = live_in[block.quads[i + 1]]
+                else:
+                    live_out = set().union(*(live_in[s.quads[0]] for s in block.succs))
+                if q.z not in live_out:
+                    dead.add(q)
+        return dead
+
+    def remove_uncalled_subprograms(self):  # the ones that can't be reached by calls starting from main
+        blocks = self.parser.asm_generator.compiled_blocks
+        called, pending = set(), ["Lmain"]
+        while pending:
+            label = pending.pop()
+            if label not in called:
+                called.add(label)
+                pending += blocks[label]["calls"]
+
+        for label, block in sorted(blocks.items(), key=lambda b: b[1]["quads"], reverse=True):
+            if label not in called:  # later blocks first, so the ranges of the earlier ones stay valid
+                del self.parser.quads[slice(*block["quads"])]
+                del self.parser.asm_generator.statements[slice(*block["statements"])]
+                del blocks[label]
+                self.stats["uncalled subprograms"] += 1
+
+    @staticmethod
+    def uses(q):
+        if q.op in ("+", "-", "*", "/") or q.op in REL_OPS:
+            return q.x, q.y
+        if q.op in (":=", "out", "retv") or q.op == "par" and q.y in ("CV", "REF"):
+            return q.x,
+        return ()
+
+    @staticmethod
+    def defs(q):
+        if q.op in ("+", "-", "*", "/", ":="):
+            return q.z,
+        if q.op == "inp" or q.op == "par" and q.y == "RET":  # the RET temporary is written by the following call
+            return q.x,
+        return ()
+
+    @staticmethod
+    def liveness(quads, names, cfg=None):  # returns the subset of names that is live before each quad
+        cfg = cfg or ControlFlowGraph(quads)
+        uses = {q: {v for v in Optimizer.uses(q) if v in names} for q in quads}
+        defs = {q: {v for v in Optimizer.defs(q) if v in names} for q in quads}
+        block_in = {b: set() for b in cfg.blocks}
+        live_in = {}
+
+        changed = True
+        while changed:
+            changed = False
+            for block in reversed(cfg.blocks):
+                live = set().union(*(block_in[s] for s in block.succs))
+                for q in reversed(block.quads):
+                    live = uses[q] | (live - defs[q])
+                    live_in[q] = live
+                if live != block_in[block]:
+                    block_in[block], changed = live, True
+        return [live_in[q] for q in quads]
+
+    @staticmethod
+    def live_ranges(quads, live_in, names):  # name -> (first, last) index of the quads where it's live or defined
+        ranges = {}
+        for i, q in enumerate(quads):
+            for v in live_in[i].union(v for v in Optimizer.defs(q) if v in names):
+                first, last = ranges.get(v, (i, i))
+                ranges[v] = (min(first, i), max(last, i))
+        return ranges
+
+    def reuse_temp_slots(self, quads, cfg=None):  # temporaries that are never live at the same time share a frame slot
+        scope = self.parser.st.scopes[-1]
+        temps = scope["entities"]["tmp_variables"]
+        live_in = self.liveness(quads, temps, cfg)
+
+        ranges = self.live_ranges(quads, live_in, temps)
+
+        base = max([12] + [ent["offset"] + 4 for cat, entities in scope["entities"].items()
+                           if cat != "tmp_variables" for ent in entities.values() if "offset" in ent])
+        free, active, slots = [], [], 0  # active: (last, offset) of the temporaries that hold a slot
+        for t, (first, last) in sorted(ranges.items(), key=lambda r: r[1]):
+            for a in [a for a in active if a[0] < first]:
+                active.remove(a)
+                free.append(a[1])
+            if free:
+                free.sort()
+                offset = free.pop(0)
+            else:
+                offset = base + 4 * slots
+                slots += 1
+            temps[t]["offset"] = offset
+            active.append((last, offset))
+
+        scope["offset"] = base + 4 * slots
+
+    @staticmethod
+    def remove_quads(quads, dead):  # jumps to a removed quad are redirected to the next kept quad
+        kept, redirect, pending = [], {}, []
+        for q in quads:
+            if q in dead:
+                pending.append(q.label)
+                continue
+            for label in pending:
+                redirect[label] = q.label
+            pending = []
+            kept.append(q)
+
+        for q in kept:
+            if q.op == "jump" or q.op in REL_OPS:
+                q.z = redirect.get(q.z, q.z)
+        return kept
+
+
+class QuadInterpreter:
+    """
+    Runs the quads of a program without assembling them. The operands of every block are resolved while its scope is
+    alive, to constants or (levels up, slot, by reference) triples, where frames are lists with the layout of the
+    activation records: [1] access link, [2] return value cell, [3:] parameters, variables and temporaries. Cells of
+    variables are (frame, slot) pairs, which is also what inout parameters hold. The labels are resolved to quad
+    indices when the program runs, after the optimizer has removed the uncalled subprograms.
+    """
+
+    GLOBAL = -1  # levels up of the variables of main, which are reached directly
+    RELATIONS = {"=": operator.eq, "<>": operator.ne, "<": operator.lt, ">": operator.gt, "<=": operator.le,
+                 ">=": operator.ge}
+
+    def __init__(self, code_parser):
+        self.parser = code_parser
+        self.resolved = {}  # quad label -> (op, x, y, z) with resolved operands
+        self.main_start = None
+        self.main_slots = 0
+
+    def resolve_block(self, start):  # resolves the operands of the block that starts at parser.quads[start]
+        st, quads = self.parser.st, self.parser.quads
+        scope = len(st.scopes) - 1
+        if scope == 0:
+            self.main_start, self.main_slots = quads[start].label, st.scopes[-1]["offset"] // 4
+        else:
+            self.parser.asm_generator.current_entity()["begin"] = quads[start].label
+
+        for q in quads[start:]:
+            if q.op == "call":
+                ent = st.find_entity(q.x, categories=("functions", "procedures"))
+                self.resolved[q.label] = (q.op, ent, scope - ent["scope"], None)
+            elif q.op == "jump":
+                self.resolved[q.label] = (q.op, None, None, q.z)
+            elif q.op in REL_OPS:
+                self.resolved[q.label] = (q.op, self.operand(q.x, scope), self.operand(q.y, scope), q.z)
+            elif q.op == "par":
+                self.resolved[q.label] = (q.op, self.operand(q.x, scope), q.y, None)
+            elif q.op in ("begin_block", "end_block", "halt"):
+                self.resolved[q.label] = (q.op, None, None, None)
+            else:
+                self.resolved[q.label] = (q.op, self.operand(q.x, scope), self.operand(q.y, scope),
+                                          self.operand(q.z, scope))
+
+    def operand(self, name, scope):
+        if not name:
+            return None
+        if Optimizer.is_const(name):
+            return None, Optimizer.wrap32(int(name)), False
+        ent = self.parser.st.find_entity(name, categories=("variables", "tmp_variables", "parameters"))
+        up = self.GLOBAL if ent["scope"] == 0 else scope - ent["scope"]
+        return up, ent["offset"] // 4, ent.get("mode") == "inout"
+
+    @staticmethod
+    def cell(frame, main, operand):  # (frame, slot) that holds the value of a variable operand
+        up, slot, ref = operand
+        if up == QuadInterpreter.GLOBAL:
+            frame = main
+        else:
+            for _ in range(up):
+                frame = frame[1]
+        return frame[slot] if ref else (frame, slot)
+
+    def load(self, frame, main, operand):
+        if operand[0] is None:
+            return operand[1]
+        frame, slot = self.cell(frame, main, operand)
+        return frame[slot]
+
+    def store(self, frame, main, operand, value):
+        frame, slot = self.cell(frame, main, operand)
+        frame[slot] = value
+
+    @staticmethod
+    def read(tokens):  # the next number of the input, raises InputError when there is none
+        token = next(tokens, None)
+        if token is None:
+            raise InputError("Unexpected end of input.")
+        try:
+            return int(token)
+        except ValueError:
+            raise InputError("Expected a number in the input, got '%s'." % token)
+
+    @staticmethod
+    def divide(a, b):  # division truncates towards zero, and raises ZeroDivisionError
+        q = abs(a) // abs(b)
+        return q if (a < 0) == (b < 0) else -q
+
+    def prepare(self):  # the resolved quads of the program, with the labels and callees replaced by quad indices
+        index = {q.label: i for i, q in enumerate(self.parser.quads)}
+        code = []
+        for q in self.parser.quads:
+            op, x, y, z = self.resolved[q.label]
+            if op == "jump" or op in REL_OPS:
+                z = index[z]
+            elif op == "call":  # x: the callee's first quad, y: levels up to its parent, z: its frame slots
+                x, z = index[x["begin"]] + 1, x["framelength"] // 4
+            code.append((op, x, y, z))
+        return code, index[self.main_start] + 1
+
+    def run(self, stdin=sys.stdin, stdout=sys.stdout):
+        code, pc = self.prepare()
+        tokens = (token for line in stdin for token in line.split())
+        main = frame = [0] * self.main_slots
+        calls, args, ret = [], [], None  # calls: (return quad index, caller frame), args: values and cells of pars
+        load, store, wrap32, relations = self.load, self.store, Optimizer.wrap32, self.RELATIONS
+
+        while True:
+            op, x, y, z = code[pc]
+            pc += 1
+            if op == "+":
+                store(frame, main, z, wrap32(load(frame, main, x) + load(frame, main, y)))
+            elif op == "-":
+                store(frame, main, z, wrap32(load(frame, main, x) - load(frame, main, y)))
+            elif op == "*":
+                store(frame, main, z, wrap32(load(frame, main, x) * load(frame, main, y)))
+            elif op == "/":
+                store(frame, main, z, wrap32(self.divide(load(frame, main, x), load(frame, main, y))))
+            elif op == ":=":
+                store(frame, main, z, load(frame, main, x))
+            elif op in REL_OPS:
+                a, b = load(frame, main, x), load(frame, main, y)
+                if relations[op](a, b):
+                    pc = z
+            elif op == "jump":
+                pc = z
+            elif op == "par":
+                if y == "CV":
+                    args.append(load(frame, main, x))
+                elif y == "REF":
+                    args.append(self.cell(frame, main, x))
+                else:
+                    ret = self.cell(frame, main, x)
+            elif op == "call":
+                callee = [0] * z
+                callee[1], callee[2] = frame, ret
+                for _ in range(y):
+                    callee[1] = callee[1][1]
+                callee[3:3 + len(args)] = args
+                calls.append((pc, frame))
+                frame, pc, args, ret = callee, x, [], None
+            elif op == "retv":
+                ret_frame, ret_slot = frame[2]
+                ret_frame[ret_slot] = load(frame, main, x)
+                pc, frame = calls.pop()
+            elif op == "end_block":
+                pc, frame = calls.pop()
+            elif op == "out":
+                stdout.write("%d\n" % load(frame, main, x))
+            elif op == "inp":
+                store(frame, main, x, wrap32(self.read(tokens)))
+            elif op == "halt":
+                return
+
+
+class QuadCompiler(QuadInterpreter):
+    """
+    Runs the quads of a program as Python code, generated from the resolved quads and compiled once per program.
+    Every subprogram becomes a function that takes its frame and switches between its basic blocks in a loop, falling
+    through to the next block without going back to the switch. Calls are Python calls, so the depth of cimple
+    recursion (that isn't eliminated by -O) is bounded by the Python recursion limit.
+    """
+
+    PY_OPS = {"=": "==", "<>": "!="}
+
+    def __init__(self, code_parser):
+        super().__init__(code_parser)
+        self.source = None
+        self.namespace = None  # the compiled functions and the globals they share: m (main's frame), out and read
+
+    def frame_expr(self, up):
+        return "m" if up == self.GLOBAL else "f" + "[1]" * up
+
+    def value_expr(self, operand):
+        up, slot, ref = operand
+        if up is None:
+            return str(slot)
+        var = "%s[%d]" % (self.frame_expr(up), slot)
+        return "%s[0][%s[1]]" % (var, var) if ref else var
+
+    def cell_expr(self, operand):
+        up, slot, ref = operand
+        return "%s[%d]" % (self.frame_expr(up), slot) if ref else "(%s, %d)" % (self.frame_expr(up), slot)
+
+    def store_lines(self, operand, value):
+        up, slot, ref = operand
+        if ref:
+            return ["c = %s[%d]" % (self.frame_expr(up), slot), "c[0][c[1]] = %s" % value]
+        return ["%s[%d] = %s" % (self.frame_expr(up), slot, value)]
+
+    def generate(self):
+        quads, names = self.parser.quads, {}
+        graphs = ControlFlowGraph.regions(quads)
+        for i, cfg in enumerate(graphs):
+            names[cfg.quads[0].label] = "b%d" % i
+
+        source = []
+        for cfg in graphs:
+            source += ["def %s(f):" % names[cfg.quads[0].label], "    blk = 0", "    while True:"]
+            for block in cfg.blocks:
+                lines, args, ret = [], [], "None"
+                for q in block.quads:
+                    op, x, y, z = self.resolved[q.label]
+                    if op in ("+", "-", "*"):
+                        lines += self.store_lines(z, "w(%s %s %s)" % (self.value_expr(x), op, self.value_expr(y)))
+                    elif op == "/":
+                        lines += self.store_lines(z, "w(div(%s, %s))" % (self.value_expr(x), self.value_expr(y)))
+                    elif op == ":=":
+                        lines += self.store_lines(z, self.value_expr(x))
+                    elif op in REL_OPS:
+                        lines += ["if %s %s %s:" % (self.value_expr(x), self.PY_OPS.get(op, op), self.value_expr(y)),
+                                  "    blk = %d" % cfg.block_of[z].index, "    continue"]
+                    elif op == "jump":
+                        lines += ["blk = %d" % cfg.block_of[z].index, "continue"]
+                    elif op == "par":
+                        if y == "CV":
+                            args.append(self.value_expr(x))
+                        elif y == "REF":
+                            args.append(self.cell_expr(x))
+                        else:
+                            ret = self.cell_expr(x)
+                    elif op == "call":
+                        frame = ["0", self.frame_expr(y) if y else "f", ret] + args
+                        frame += ["0"] * (x["framelength"] // 4 - len(frame))
+                        lines.append("%s([%s])" % (names[x["begin"]], ", ".join(frame)))
+                        args, ret = [], "None"
+                    elif op == "retv":
+                        lines += ["c = f[2]", "c[0][c[1]] = %s" % self.value_expr(x), "return"]
+                    elif op in ("end_block", "halt"):
+                        lines.append("return")
+                    elif op == "out":
+                        lines.append("out(%s)" % self.value_expr(x))
+                    elif op == "inp":
+                        lines += self.store_lines(x, "w(read())")
+                source.append("        if blk == %d:" % block.index)
+                source += ["            " + line for line in lines]
+                last = block.quads[-1].op
+                if last != "jump" and last not in ControlFlowGraph.TERMINAL_OPS and block.index + 1 < len(cfg.blocks):
+                    source.append("            blk = %d" % (block.index + 1))
+        return "\n".join(source) + "\n", names[self.main_start]
+
+    def run(self, stdin=sys.stdin, stdout=sys.stdout):
+        if self.namespace is None:
+            self.source, main_name = self.generate()
+            self.namespace = {"w": Optimizer.wrap32, "div": self.divide}
+            exec(compile(self.source, "<cimple>", "exec"), self.namespace)
+            self.namespace["main"] = self.namespace[main_name]
+
+        tokens = (token for line in stdin for token in line.split())
+        self.namespace["m"] = main = [0] * self.main_slots
+        self.namespace["out"] = lambda value: stdout.write("%d\n" % value)
+        self.namespace["read"] = lambda: self.read(tokens)
+        self.namespace["main"](main)
+
+
 class Parser:
-    def __init__(self, lexer):
+    def __init__(self, lexer, stream=False, optimize=False, regalloc=False, inline_threshold=0, display=False,
+                 interpret=False, jit=False):
+        self.lexer = lexer
         self.lines = lexer.lines
+        self.stream = stream  # pull tokens lazily, the token list only holds the lookahead
         self.tokens = []
         self.token_idx = 0
         self.quads = []
+        self.quad_seq = 0
         self.temp_seq = 0
         self.st = SymbolTable(self)
-        self.asm_generator = AsmGenerator(self)
+        self.asm_generator = AsmGenerator(self, regalloc=regalloc, optimize=optimize, display=display)
+        self.c_generator = CGenerator(self)
+        self.optimizer = Optimizer(self, inline_threshold=inline_threshold) if optimize else None
+        self.interpreter = (QuadCompiler if jit else QuadInterpreter)(self) if interpret or jit else None
 
-        while True:
-            u = lexer.next()
-            if u is None:
-                break
-            self.tokens.append(Token(lexer, u, FilePos(lexer.pos.ln, lexer.pos.cl - len(u))))
+        if not stream:
+            self.tokens = list(iter(lexer.next_token, None))
 
     def next(self, peek=False):
+        if self.stream and self.token_idx == len(self.tokens):
+            t = self.lexer.next_token()
+            self.tokens, self.token_idx = [] if t is None else [t], 0
+
         try:
             t = self.tokens[self.token_idx]
             self.token_idx = self.token_idx if peek else self.token_idx + 1
@@ -190,7 +1804,7 @@ class Parser:
         return self.next(peek=True)
 
     def next_quad_label(self):
-        return "L_" + str(len(self.quads) + 1)
+        return "L_" + str(self.quad_seq + 1)  # optimizations remove quads, so labels don't follow len(quads)
 
     def new_temp(self):
         self.temp_seq += 1
@@ -200,6 +1814,7 @@ class Parser:
 
     def new_quad(self, op="", x="", y="", z=""):
         self.quads.append(Quad(self.next_quad_label(), op, x, y, z))
+        self.quad_seq += 1
         return self.quads[-1]
 
     @staticmethod
@@ -213,20 +1828,28 @@ class Parser:
         ident = self.next().assert_is_identifier()
         self.st.create_scope(name=ident.value)
         self.parse_block(ident.value, is_main=True)
-        self.st.scopes.pop()
+        self.st.pop_scope()
         self.next().assert_value_is(".")
+        if self.optimizer:
+            self.optimizer.remove_uncalled_subprograms()
 
     def parse_block(self, name, is_main=False):
         self.next().assert_value_is("{")
         self.parse_declarations()
         self.parse_subprograms()
+        block_start = len(self.quads)
         self.new_quad("begin_block", name, z="main" if is_main else "")
         self.parse_block_statements()
         if is_main:
             self.new_quad("halt")
         self.new_quad("end_block", name)
         self.next().assert_value_is("}")
+        if self.optimizer:
+            self.optimizer.optimize_block(block_start)
         self.asm_generator.compile_block(name)
+        self.c_generator.resolve_block(block_start)
+        if self.interpreter:
+            self.interpreter.resolve_block(block_start)
 
     def parse_declarations(self):
         while True:
@@ -267,7 +1890,7 @@ class Parser:
             self.st.add_new_entity(category="parameters", name=p["name"], entity={"mode": p["mode"]})
         self.parse_block(ident.value)
         entity["framelength"] = self.st.scopes[-1]["offset"]
-        self.st.scopes.pop()
+        self.st.pop_scope()
 
     def parse_formalparlist(self):
         params = []
@@ -456,12 +2079,18 @@ class Parser:
         if not self.peek().value_in(("in", "inout")):
             return
 
+        pars = []
         while True:
-            self.parse_actualparitem()
+            pars.append(self.parse_actualparitem())
             if not self.peek().value_is(","):
-                return
+                break
             self.next()
 
+        # all the arguments are evaluated before passing the first one, so that calls inside the arguments
+        # are done before the call that they are passed to starts filling its activation record.
+        for it, mode in pars:
+            self.new_quad("par", it, mode)
+
     def parse_actualparitem(self):
         par_typ = self.next().assert_value_in(("in", "inout"))
 
@@ -470,7 +2099,7 @@ class Parser:
         else:
             it = self.parse_expression()
 
-        self.new_quad("par", it, "CV" if par_typ.value == "in" else "REF")
+        return it, "CV" if par_typ.value == "in" else "REF"
 
     def parse_condition(self):
         tf = TrueFalse()
@@ -573,21 +2202,13 @@ class Parser:
         if self.peek().value_in(ADD_OPS):
             return self.next()
 
-    def gen_c_equivalent(self):
-        variables = set()
-        for q in self.quads:
-            if q.op == "begin_block" and q.label != "L_1":
-                raise Exception("Cannot generate c code for programs that include functions and procs!")
-
-            [variables.add(v) for v in (q.x, q.y, q.z) if
-             v.isidentifier() and v not in ("CV", "REF", "RET") and not v.startswith("L_")]
-
-        declarations = "int " + ", ".join(variables) + ";\n"
-        body = "".join([f"// {str(q)}\n{q.label}:\t {q.to_c()};\n" for q in self.quads])
-        return f"#include <stdlib.h>\n#include <stdio.h>\nint main() {{\n{declarations + body}\nreturn 0;\n}}"
+    def gen_c_equivalent(self, structured=False):
+        return self.c_generator.gen_c_equivalent(structured)
 
 
 class Quad:
+    __slots__ = ("label", "op", "x", "y", "z")
+
     def __init__(self, label="", op="", x="", y="", z=""):
         self.label = label
         self.op = op
@@ -618,6 +2239,8 @@ class Quad:
 
 
 class TrueFalse:
+    __slots__ = ("t", "f")
+
     def __init__(self, t=None, f=None):
         self.t = t if t is not None else []
         self.f = f if f is not None else []
@@ -632,6 +2255,12 @@ class Lex:
         self.lines = src.split("\n")
         self.pos = FilePos()
 
+    def next_token(self):
+        u = self.next()
+        if u is None:
+            return None
+        return Token(self, u, FilePos(self.pos.ln, self.pos.cl - len(u)))
+
     def next_char(self, peek=False):
         if self.pos.ln >= len(self.lines):
             return None
@@ -647,7 +2276,7 @@ class Lex:
         return c
 
     def next(self):
-        c = self.next_char(peek=True)
+        c = self.skip_trivia()
 
         if c is None:
             return None
@@ -672,20 +2301,29 @@ class Lex:
             if self.next_char(peek=True) != "=":
                 raise CompilationError("Invalid assignment operator", self.pos, self.lines)
             return u + self.next_char()
-        elif c == "#":
-            self.next_char()
-            c = self.next_char()
-            while c not in ("#", None):
-                c = self.next_char()
-            if c is None:
-                raise CompilationError("Unterminated comment at the end of the program.")
-            return self.next()
-        elif c in (" ", "\t", "\r\n", "\n"):
-            self.next_char()
-            return self.next()
         else:
             raise CompilationError("Invalid character %s" % repr(c), self.pos, self.lines)
 
+    def skip_trivia(self):  # skips whitespace and comments, returns the next (peeked) char
+        while True:
+            c = self.next_char(peek=True)
+
+            if c == "\n":
+                self.next_char()
+            elif c in (" ", "\t"):
+                line = self.lines[self.pos.ln]
+                self.pos.cl = len(line) - len(line[self.pos.cl:].lstrip(" \t"))
+            elif c == "#":
+                end = self.lines[self.pos.ln].find("#", self.pos.cl + 1)
+                while end == -1:
+                    self.pos.ln += 1
+                    if self.pos.ln >= len(self.lines):
+                        raise CompilationError("Unterminated comment at the end of the program.")
+                    end = self.lines[self.pos.ln].find("#")
+                self.pos.cl = end + 1
+            else:
+                return c
+
     def parse_var(self):
         u = self.next_char()
         while True:
@@ -709,7 +2347,59 @@ class Lex:
             u += self.next_char()
 
 
+class RegexLex(Lex):
+    """Scans whole tokens with one compiled regex, produces the same tokens and cursors as Lex."""
+
+    TOKEN_RE = re.compile(r"[ \t]*(?:(?P<id>[A-Za-z][^\W_]*)|(?P<const>[0-9]+)"
+                          r"|(?P<op><[=>]?|>=?|:=?|[-+*/=;,\[\](){}.])|(?P<comment>#)|(?P<other>.?))")
+
+    def next(self):
+        lines, pos = self.lines, self.pos
+
+        while pos.ln < len(lines):
+            line = lines[pos.ln]
+            m = self.TOKEN_RE.match(line, pos.cl)
+            kind = m.lastgroup
+            u = m.group(kind)
+            pos.cl = m.end()
+
+            if kind == "id":
+                if len(u) > 30:
+                    pos.cl = m.start(kind) + 31
+                    raise CompilationError("Variable name cannot be more than 30 chars.", pos, lines)
+                return u
+            elif kind == "const":
+                if pos.cl < len(line) and line[pos.cl] in string.ascii_letters:
+                    raise CompilationError("Variable name cannot start with a number.", pos, lines)
+                if int(u) > 2 ** 32 - 1:
+                    raise CompilationError("Constant max value is 2^32-1 (%d)." % (2 ** 32 - 1), pos, lines)
+                return u
+            elif kind == "op":
+                if u == ":":
+                    raise CompilationError("Invalid assignment operator", pos, lines)
+                return u
+            elif kind == "comment":
+                end = line.find("#", pos.cl)
+                while end == -1:
+                    pos.ln += 1
+                    if pos.ln >= len(lines):
+                        raise CompilationError("Unterminated comment at the end of the program.")
+                    line = lines[pos.ln]
+                    end = line.find("#")
+                pos.cl = end + 1
+            elif u:
+                pos.cl -= 1
+                raise CompilationError("Invalid character %s" % repr(u), pos, lines)
+            else:  # end of line
+                pos.ln += 1
+                pos.cl = 0
+
+        return None
+
+
 class Token:
+    __slots__ = ("lex", "value", "cursor")
+
     def __init__(self, lexer, value, cursor):
         self.lex = lexer
         self.value = value
@@ -745,6 +2435,8 @@ class Token:
 
 
 class FilePos:
+    __slots__ = ("ln", "cl")
+
     def __init__(self, ln=0, cl=0):
         self.ln, self.cl = ln, cl
 
@@ -768,22 +2460,63 @@ class CompilationError(Exception):
         return s
 
 
+class InputError(Exception):
+    pass
+
+
 if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Compiles cimple programs to RISC-V assembly.")
+    arg_parser.add_argument("filename")
+    arg_parser.add_argument("--gen-c", action="store_true", help="also generate the C equivalent code")
+    arg_parser.add_argument("--structured-c", action="store_true",
+                            help="with --gen-c, generate loops and ifs instead of a goto per quad")
+    arg_parser.add_argument("--stream", action="store_true", help="read tokens lazily instead of all at once")
+    arg_parser.add_argument("--regex-lex", action="store_true", help="scan the source with the regex based lexer")
+    arg_parser.add_argument("-O", dest="optimize", action="store_true", help="optimize the intermediate code")
+    arg_parser.add_argument("--regalloc", action="store_true", help="keep variables in registers where possible")
+    arg_parser.add_argument("--inline", type=int, default=0, metavar="N",
+                            help="with -O, inline the calls to subprograms of at most N quads")
+    arg_parser.add_argument("--display", action="store_true", help="access nonlocal variables through a display")
+    arg_parser.add_argument("--run", action="store_true", help="run the program with the quad interpreter")
+    arg_parser.add_argument("--jit", action="store_true", help="run the program compiled to Python functions")
+    arg_parser.add_argument("--stats", action="store_true", help="print how many times each optimization applied")
+    args = arg_parser.parse_args()
+
     try:
-        filename = sys.argv[1]
-        gen_c = len(sys.argv) > 2 and sys.argv[2] == "--gen-c"
+        filename = args.filename
 
-        parser = Parser(Lex(open(filename, "r").read()))
+        lexer = (RegexLex if args.regex_lex else Lex)(open(filename, "r").read())
+        parser = Parser(lexer, stream=args.stream, optimize=args.optimize, regalloc=args.regalloc,
+                        inline_threshold=args.inline, display=args.display, interpret=args.run,
+                        jit=args.jit)
         parser.parse_program()
 
-        if gen_c:
+        if args.gen_c:
             with open(filename + ".c", "w") as cf:
-                cf.write(parser.gen_c_equivalent())
+                cf.write(parser.gen_c_equivalent(structured=args.structured_c))
 
         with open(filename + ".asm", "w") as af:
             af.write(parser.asm_generator.gen_asm_equivalent())
+
+        if args.stats and parser.optimizer:
+            for name, count in parser.optimizer.stats.items():
+                print("optimizer, %s: %d" % (name, count))
+            for name, count in parser.asm_generator.peephole_stats.items():
+                print("peephole, %s: %d" % (name, count))
+
+        if args.run or args.jit:
+            parser.interpreter.run()
     except CompilationError as e:
         print(e)
         sys.exit(2)
+    except ZeroDivisionError:
+        print("ERROR: Division by zero.")
+        sys.exit(1)
+    except InputError as e:
+        print("ERROR: %s" % e)
+        sys.exit(1)
+    except RecursionError:  # --jit runs cimple calls as Python calls
+        print("ERROR: Recursion too deep%s." % (", run the program with --run instead" if args.jit else ""))
+        sys.exit(1)
     except Exception as e:
         raise e
@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+
+import argparse
+import re
+import sys
+
+REGISTERS = ["zero", "ra", "sp", "gp", "tp", "t0", "t1", "t2", "s0", "s1"] + ["a%d" % i for i in range(8)] + \
+            ["s%d" % i for i in range(2, 12)] + ["t%d" % i for i in range(3, 7)]
+ALIASES = {"fp": "s0"}
+
+BRANCHES = {"beq": lambda a, b: a == b, "bne": lambda a, b: a != b, "blt": lambda a, b: a < b,
+            "bgt": lambda a, b: a > b, "ble": lambda a, b: a <= b, "bge": lambda a, b: a >= b}
+
+
+class SimulationError(Exception):
+    pass
+
+
+class RiscvSimulator:
+    """
+    Runs the RISC-V assembly of gen_asm_equivalent, the RV32IM instructions that AsmGenerator emits and the ecall
+    services of print int (1), print string (4), read int (5) and exit (93, 10). Memory is a dict of words, strings
+    of the data segment are kept as they are, and registers hold signed 32bit values. Counts the executed
+    instructions, loads, stores and branches, so the generated code can be measured without an external simulator.
+    """
+
+    DATA = 0x10010000
+    STACK = 0x10040000  # the frames grow upwards
+
+    def __init__(self, asm, stdin=sys.stdin, stdout=sys.stdout):
+        self.stdin = stdin
+        self.stdout = stdout
+        self.tokens = None
+        self.symbols = {}  # .eqv symbol or data label -> value or address
+        self.strings = {}  # address -> .asciiz string
+        self.labels = {}  # text label -> instruction index
+        self.code = []  # (op, operands), operands are register names, ints or (offset, register) pairs
+        self.regs = dict.fromkeys(REGISTERS, 0)
+        self.memory = {}
+        self.stats = {"instructions": 0, "loads": 0, "stores": 0, "branches": 0, "taken branches": 0, "jumps": 0,
+                      "ecalls": 0}
+        self.exit_code = None
+        self.load_asm(asm)
+
+    def load_asm(self, asm):
+        data, section, text = self.DATA, ".text", []
+        for line in asm.split("\n"):
+            line = line.strip()
+            if not line or line.startswith(".global"):
+                continue
+            if line in (".data", ".text"):
+                section = line
+            elif line.startswith(".eqv"):
+                name, value = line[len(".eqv"):].split(",")
+                self.symbols[name.strip()] = int(value)
+            elif section == ".data":
+                label, directive, arg = re.match(r"(\w+):\s*(\.\w+)\s*(.*)", line).groups()
+                self.symbols[label] = data
+                if directive == ".asciiz":
+                    self.strings[data] = arg[1:-1].encode().decode("unicode_escape")
+                    data += len(self.strings[data]) + 1
+                else:
+                    data += int(arg)
+                data = (data + 3) & ~3
+            elif line.endswith(":"):
+                self.labels[line[:-1]] = len(text)
+            else:
+                op, _, args = line.partition(" ")
+                text.append((op, [a.strip() for a in args.split(",")] if args else []))
+
+        self.code = [(op, [self.operand(op, a) for a in args]) for op, args in text]
+
+    def operand(self, op, arg):
+        arg = ALIASES.get(arg, arg)
+        if arg in self.regs:
+            return arg
+        if op in BRANCHES or op in ("j", "jal"):
+            if arg not in self.labels:
+                raise SimulationError("Unknown label: %s" % arg)
+            return self.labels[arg]
+        m = re.fullmatch(r"([-\w]*)\((\w+)\)", arg)
+        if m:
+            return self.immediate(m.group(1) or "0"), ALIASES.get(m.group(2), m.group(2))
+        return self.immediate(arg)
+
+    def immediate(self, arg):
+        sign, name = (-1, arg[1:]) if arg.startswith("-") else (1, arg)
+        if name in self.symbols:
+            return sign * self.symbols[name]
+        try:
+            return int(arg, 0)
+        except ValueError:
+            raise SimulationError("Unknown symbol: %s" % arg)
+
+    @staticmethod
+    def wrap32(v):
+        return (v + 2 ** 31) % 2 ** 32 - 2 ** 31
+
+    def load(self, addr):
+        if addr % 4:
+            raise SimulationError("Unaligned load from 0x%x" % addr)
+        return self.memory.get(addr, 0)
+
+    def store(self, addr, value):
+        if addr % 4:
+            raise SimulationError("Unaligned store to 0x%x" % addr)
+        self.memory[addr] = value
+
+    def ecall(self):
+        regs, service = self.regs, self.regs["a7"]
+        if service == 1:
+            self.stdout.write("%d" % regs["a0"])
+        elif service == 4:
+            self.stdout.write(self.strings[regs["a0"]])
+        elif service == 5:
+            if self.tokens is None:
+                self.tokens = (token for line in self.stdin for token in line.split())
+            token = next(self.tokens, None)
+            if token is None:
+                raise SimulationError("Unexpected end of input")
+            try:
+                regs["a0"] = self.wrap32(int(token))
+            except ValueError:
+                raise SimulationError("Expected a number in the input, got '%s'" % token)
+        elif service in (10, 93):
+            self.exit_code = regs["a0"] if service == 93 else 0
+        else:
+            raise SimulationError("Unsupported ecall service: %d" % service)
+
+    def run(self, max_steps=None):  # returns the stats, raises SimulationError when max_steps are exceeded
+        regs, code, stats, wrap32, load, store = self.regs, self.code, self.stats, self.wrap32, self.load, self.store
+        regs["sp"] = self.STACK
+        pc = self.labels["__start"]
+
+        while self.exit_code is None:
+            if pc >= len(code):
+                raise SimulationError("Execution ran past the end of the program")
+            if max_steps is not None and stats["instructions"] >= max_steps:
+                raise SimulationError("Exceeded %d instructions" % max_steps)
+            op, args = code[pc]
+            pc += 1
+            stats["instructions"] += 1
+
+            if op == "lw":
+                offset, base = args[1]
+                regs[args[0]] = load(regs[base] + offset)
+                stats["loads"] += 1
+            elif op == "sw":
+                offset, base = args[1]
+                store(regs[base] + offset, regs[args[0]])
+                stats["stores"] += 1
+            elif op == "addi":
+                regs[args[0]] = wrap32(regs[args[1]] + args[2])
+            elif op == "li":
+                regs[args[0]] = wrap32(args[1])
+            elif op == "mv":
+                regs[args[0]] = regs[args[1]]
+            elif op in BRANCHES:
+                stats["branches"] += 1
+                if BRANCHES[op](regs[args[0]], regs[args[1]]):
+                    stats["taken branches"] += 1
+                    pc = args[2]
+            elif op == "j":
+                stats["jumps"] += 1
+                pc = args[0]
+            elif op == "jal":
+                stats["jumps"] += 1
+                regs["ra"], pc = pc, args[0]
+            elif op == "jr":
+                stats["jumps"] += 1
+                pc = regs[args[0]]
+            elif op == "add":
+                regs[args[0]] = wrap32(regs[args[1]] + regs[args[2]])
+            elif op == "sub":
+                regs[args[0]] = wrap32(regs[args[1]] - regs[args[2]])
+            elif op == "mul":
+                regs[args[0]] = wrap32(regs[args[1]] * regs[args[2]])
+            elif op == "div":  # rounds towards zero, division by zero gives -1 instead of trapping
+                a, b = regs[args[1]], regs[args[2]]
+                q = -1 if b == 0 else abs(a) // abs(b) * (1 if (a < 0) == (b < 0) else -1)
+                regs[args[0]] = wrap32(q)
+            elif op == "slli":
+                regs[args[0]] = wrap32(regs[args[1]] << args[2])
+            elif op == "srli":
+                regs[args[0]] = wrap32((regs[args[1]] & 0xffffffff) >> args[2])
+            elif op == "srai":
+                regs[args[0]] = regs[args[1]] >> args[2]
+            elif op == "la":
+                regs[args[0]] = args[1]
+            elif op == "ecall":
+                stats["ecalls"] += 1
+                self.ecall()
+            else:
+                raise SimulationError("Unsupported instruction: %s" % op)
+            regs["zero"] = 0
+
+        return stats
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Runs the RISC-V assembly generated by cc.py")
+    arg_parser.add_argument("filename", type=str, help="the .asm file")
+    arg_parser.add_argument("--max-steps", type=int, default=None, help="stop after N instructions")
+    arg_parser.add_argument("--stats", action="store_true", help="print the executed instruction counts to stderr")
+    args = arg_parser.parse_args()
+
+    try:
+        simulator = RiscvSimulator(open(args.filename, "r").read())
+        stats = simulator.run(max_steps=args.max_steps)
+    except SimulationError as e:
+        print("ERROR: %s" % e, file=sys.stderr)
+        sys.exit(2)
+
+    if args.stats:
+        for name, count in stats.items():
+            print("%s: %d" % (name, count), file=sys.stderr)
+    sys.exit(simulator.exit_code)
@@ -1,13 +1,18 @@
+import io
+import os
+import random
 import subprocess
+import sys
 import unittest
 import uuid
 
 from cc import *
+from rvsim import RiscvSimulator, SimulationError
 
 
 class TestParser(unittest.TestCase):
-    def parse(self, src):
-        my_cool_parser = Parser(Lex(src))
+    def parse(self, src, lex_class=Lex):
+        my_cool_parser = Parser(lex_class(src))
         my_cool_parser.parse_program()
 
     def test_long_varname(self):
@@ -133,6 +138,12 @@ class TestParser(unittest.TestCase):
         }.
         """)
 
+    def test_long_whitespace_and_comment_runs(self):
+        trivia = "".join(("\n", "    \t  \n", "# comment #\n", "# multi\n line # # another # \n")[i % 4]
+                         for i in range(100000))
+        for lex_class in (Lex, RegexLex):
+            self.parse("program trivia {" + trivia + "print(1);" + trivia + "}." + trivia, lex_class)
+
     def test_complex_args(self):
         self.parse("""
         program largenumber {
@@ -149,22 +160,381 @@ class TestParser(unittest.TestCase):
         }.
         """)
 
+    def test_stream_mode_generates_the_same_quads(self):
+        with open("examples/05_primes.ci") as fp:
+            src = fp.read()
 
-class TestGeneratedCCode(unittest.TestCase):
-    def assert_c_output_is(self, expected_outputs, src):
-        my_cool_parser = Parser(Lex(src))
+        parsers = [Parser(Lex(src), stream=stream) for stream in (False, True)]
+        for parser in parsers:
+            parser.parse_program()
+
+        self.assertEqual([str(q) for q in parsers[0].quads], [str(q) for q in parsers[1].quads])
+        self.assertLessEqual(len(parsers[1].tokens), 1)
+
+    def test_stream_mode_reports_the_first_error_first(self):
+        try:
+            Parser(Lex("""
+            program streamed {
+                declare x
+                x := 15 ^ 4;
+            }.
+            """), stream=True).parse_program()
+            assert False
+        except CompilationError as e:
+            assert "closest expected value: ';'" in str(e)
+
+
+class TestRegexLex(unittest.TestCase):
+    def scan(self, lex_class, src):
+        lexer = lex_class(src)
+        try:
+            return [(t.value, t.cursor.ln, t.cursor.cl) for t in iter(lexer.next_token, None)]
+        except CompilationError as e:
+            return str(e)
+
+    def assert_same_scan(self, src):
+        self.assertEqual(self.scan(Lex, src), self.scan(RegexLex, src))
+
+    def test_examples(self):
+        for example in ("01_hello_world", "02_fib1", "03_fib2", "04_digitcount", "05_primes", "06_sum"):
+            with open(f"examples/{example}.ci") as fp:
+                self.assert_same_scan(fp.read())
+
+    def test_operators_and_comments(self):
+        self.assert_same_scan("a:=b<=c<>d>=e<f>g=h+i-j*k/l;[m],(n){o}.\n\t# multi\nline # x # #1#2")
+
+    def test_errors(self):
+        for src in ("x := 1 ^ 2", "a : = b", "declare 12ab;", "x := 4294967296\n",
+                    "declare abcdefghijklmnopqrstuvwxyzabcdefgh;", "x := 1 # never closed\n\n"):
+            self.assert_same_scan(src)
+
+    def test_parses_like_lex(self):
+        with open("examples/05_primes.ci") as fp:
+            src = fp.read()
+
+        parsers = [Parser(lex_class(src)) for lex_class in (Lex, RegexLex)]
+        for parser in parsers:
+            parser.parse_program()
+
+        self.assertEqual([str(q) for q in parsers[0].quads], [str(q) for q in parsers[1].quads])
+
+
+class TestOptimizer(unittest.TestCase):
+    def optimized_quads(self, src):
+        my_cool_parser = Parser(Lex(src), optimize=True)
+        my_cool_parser.parse_program()
+        return [(q.op, q.x, q.y, q.z) for q in my_cool_parser.quads]
+
+    def test_constant_folding(self):
+        # x and y are only read through their constant values, so their assignments are dead
+        self.assertEqual([("begin_block", "p", "", "main"), ("out", "5", "", ""), ("halt", "", "", ""),
+                          ("end_block", "p", "", "")],
+                         self.optimized_quads("""
+                         program p {
+                             declare x, y;
+                             x := 2 * 3 + 4;
+                             y := x / 2;
+                             print(y)
+                         }.
+                         """))
+
+    def test_constant_conditions_are_resolved(self):
+        quads = self.optimized_quads("""
+        program p {
+            declare x;
+            x := 1;
+            if (x > 0) print(1); else print(2);
+        }.
+        """)
+        self.assertNotIn(">", [q[0] for q in quads])
+
+    def test_jumps_are_threaded(self):
+        my_cool_parser = Parser(Lex("""
+        program p {
+            declare x, y;
+            input(x);
+            while (x > 0 and not [x = 3] or y > 100) {
+                y := y + x;
+                x := x - 1
+            }
+        }.
+        """), optimize=True)
+        my_cool_parser.parse_program()
+        quads = my_cool_parser.quads
+        labels = {q.label: i for i, q in enumerate(quads)}
+
+        # every branch of the condition is a single negated branch, without jumps after it
+        self.assertEqual(["<=", "<>", "<="], [q.op for q in quads if q.op in REL_OPS])
+        self.assertEqual(1, [q.op for q in quads].count("jump"))
+        for i, q in enumerate(quads):
+            if q.op == "jump" or q.op in REL_OPS:
+                self.assertNotEqual("jump", quads[labels[q.z]].op)
+                self.assertNotEqual(i + 1, labels[q.z])
+
+    def test_dead_code_is_removed(self):
+        quads = self.optimized_quads("""
+        program p {
+            declare x, y;
+            function f(in a) {
+                declare b;
+                b := a * 2;
+                return (a);
+                print(b)
+            }
+            input(x);
+            y := x + 1;
+            y := f(in x);
+            print(y)
+        }.
+        """)
+        self.assertEqual([("begin_block", "f", "", ""), ("retv", "a", "", ""), ("end_block", "f", "", "")],
+                         quads[:3])
+        self.assertNotIn("+", [q[0] for q in quads])
+
+    def test_variables_of_nested_subprograms_are_kept(self):
+        quads = self.optimized_quads("""
+        program p {
+            declare x;
+            procedure show() {
+                print(x)
+            }
+            input(x);
+            x := x + 1;
+            call show()
+        }.
+        """)
+        self.assertIn("+", [q[0] for q in quads])
+
+    def test_uncalled_subprograms_are_removed(self):
+        my_cool_parser = Parser(Lex("""
+        program p {
+            declare x;
+            procedure unused() {
+                procedure p2() {
+                    print(2)
+                }
+                call p2()
+            }
+            function fact(in n) {
+                if (n <= 1) {return (1)};
+                return (n * fact(in n - 1))
+            }
+            print(fact(in 5))
+        }.
+        """), optimize=True)
+        my_cool_parser.parse_program()
+
+        self.assertEqual(["fact", "p"], [q.x for q in my_cool_parser.quads if q.op == "begin_block"])
+        self.assertEqual(["fact__2:", "Lmain:"], [s for s in my_cool_parser.asm_generator.statements
+                                                  if s.endswith(":") and not s.startswith("L_")])
+        self.assertEqual(2, my_cool_parser.optimizer.stats["uncalled subprograms"])
+
+    def test_common_subexpressions(self):
+        quads = self.optimized_quads("""
+        program p {
+            declare a, b, c;
+            input(a);
+            input(b);
+            c := (a + b) * (b + a);
+            if (a + b > c) {
+                print(a + b)
+            };
+            input(a);
+            print(a + b);
+        }.
+        """)
+        self.assertEqual(2, [q[0] for q in quads].count("+"))  # a + b is computed again only after input(a)
+        self.assertEqual(("*", "T_1", "T_1", "T_3"), [q for q in quads if q[0] == "*"][0])
+
+    def test_loop_invariants_are_hoisted(self):
+        my_cool_parser = Parser(Lex("""
+        program p {
+            declare i, n, s;
+            input(n);
+            i := 0;
+            while (i < n / 2) {
+                s := s + n * 3;
+                i := i + 1
+            };
+            print(s)
+        }.
+        """), optimize=True)
         my_cool_parser.parse_program()
-        c_equivalent = my_cool_parser.gen_c_equivalent()
+        quads = my_cool_parser.quads
+        header = next(i for i, q in enumerate(quads) if q.op in REL_OPS)
+        back_edge = next(i for i, q in enumerate(quads) if q.op == "jump")
 
+        self.assertEqual(["/", "*"], [q.op for q in quads[:header] if q.op in ("+", "-", "*", "/")])
+        self.assertEqual(quads[header].label, quads[back_edge].z)  # the back edge skips the preheader
+        self.assertEqual(["+", "+"], [q.op for q in quads[header:back_edge] if q.op in ("+", "-", "*", "/")])
+        self.assertEqual(2, my_cool_parser.optimizer.stats["loop invariants"])
+
+    def test_loop_variants_stay_in_the_loop(self):
+        quads = self.optimized_quads("""
+        program p {
+            declare i, n;
+            procedure inc(inout a) {
+                a := a + 1
+            }
+            input(n);
+            i := 0;
+            while (i < 10) {
+                print(n * 2);
+                print(i / 0);
+                call inc(inout n);
+                i := i + 1
+            }
+        }.
+        """)
+        main = [q[0] for q in quads].index("begin_block", 1)
+        header = next(i for i, q in enumerate(quads) if q[0] in REL_OPS)
+        self.assertEqual([], [q for q in quads[main:header] if q[0] in ("+", "-", "*", "/")])
+
+    def test_inlining_needs_the_same_names(self):
+        my_cool_parser = Parser(Lex("""
+        program p {
+            declare x;
+            procedure show() {
+                print(x)
+            }
+            procedure shadows() {
+                declare x;
+                x := 2;
+                call show()
+            }
+            function large(in a) {
+                a := a + 1;
+                a := a + 2;
+                return (a + 3)
+            }
+            x := 1;
+            call show();
+            call shadows();
+            print(large(in x))
+        }.
+        """), optimize=True, inline_threshold=3)
+        my_cool_parser.parse_program()
+
+        # show isn't inlined in shadows, where x is another variable, and large has too many quads
+        self.assertEqual(["show", "large"], [q.x for q in my_cool_parser.quads if q.op == "call"])
+        self.assertEqual(2, my_cool_parser.optimizer.stats["inlined calls"])
+
+    def test_calls_invalidate_constants(self):
+        quads = self.optimized_quads("""
+        program p {
+            declare x;
+            procedure inc(inout y) { y := y + 1; }
+            x := 1;
+            call inc(inout x);
+            print(x)
+        }.
+        """)
+        self.assertIn(("out", "x", "", ""), quads)
+
+    def test_par_modes_are_not_variables(self):
+        src = """
+        program p {
+            declare CV, r;
+            function f(in a) { return (a + 1) }
+            CV := 5;
+            r := f(in 7);
+            print(r);
+            print(CV)
+        }.
+        """
+        self.assertEqual(["CV", "RET"], [q[2] for q in self.optimized_quads(src) if q[0] == "par"])
+        my_cool_parser = Parser(Lex(src), optimize=True, interpret=True)
+        my_cool_parser.parse_program()
+        stdout = io.StringIO()
+        my_cool_parser.interpreter.run(io.StringIO(), stdout)
+        self.assertEqual("8\n5\n", stdout.getvalue())
+
+    def test_tail_recursion_becomes_a_loop(self):
+        quads = self.optimized_quads("""
+        program p {
+            function gcd(in a, in b) {
+                if (b = 0) { return (a) };
+                return (gcd(in b, in a - a / b * b))
+            }
+            function fact(in n) {
+                if (n = 0) { return (1) };
+                return (n * fact(in n - 1))
+            }
+            print(gcd(in 1071, in 462));
+            print(fact(in 5))
+        }.
+        """)
+        gcd = quads[:[q[0] for q in quads].index("end_block")]
+        self.assertNotIn("call", [q[0] for q in gcd])
+        self.assertEqual(("jump", "", ""), gcd[-1][:3])
+        self.assertEqual(("<>", "b", "0"), gcd[1][:3])  # the first quad after begin_block is its target
+        # a and b are assigned after both arguments are computed, the second one reads a
+        self.assertEqual([":=", ":=", ":=", ":="], [q[0] for q in gcd[-5:-1]])
+        self.assertEqual(["a", "b"], [q[3] for q in gcd[-3:-1]])
+        self.assertIn(("call", "fact", "", ""), quads)  # its result is multiplied before being returned
+
+    def test_temporaries_share_frame_slots(self):
+        src = """
+        program p {
+            declare x;
+            function f(in a) {
+                declare b;
+                b := (a + 1) * (a + 2);
+                b := (b - a) * (b + a) / (a + 3);
+                x := f(in b) + f(in b + 1);
+                return (x * b + 1)
+            }
+            x := f(in 1)
+        }.
+        """
+        framelengths = []
+        for optimize in (False, True):
+            my_cool_parser = Parser(Lex(src), optimize=optimize)
+            my_cool_parser.parse_program()
+            statements = my_cool_parser.asm_generator.statements
+            framelengths.append({statements[i - 1] for i, s in enumerate(statements) if s.startswith("jal f")})
+
+        self.assertEqual([{"addi sp,sp,%d" % (12 + 4 * 2 + 4 * 14)}, {"addi sp,sp,%d" % (12 + 4 * 2 + 4 * 3)}],
+                         framelengths)
+
+    def test_live_temporaries_keep_their_own_slots(self):
+        class CheckedOptimizer(Optimizer):
+            def reuse_temp_slots(opt, quads, cfg=None):
+                super().reuse_temp_slots(quads, cfg)
+                temps = opt.parser.st.scopes[-1]["entities"]["tmp_variables"]
+                for live in opt.liveness(quads, temps):
+                    self.assertEqual(len(live), len({temps[t]["offset"] for t in live}))
+
+        for src in [open(f"examples/{e}.ci").read() for e in ("02_fib1", "03_fib2", "05_primes")] + ["""
+        program p {
+            declare x;
+            incase
+                case (x < 10) x := x + 1 * x;
+                case (x < 20) x := x + 2 * x;
+        }.
+        """]:
+            my_cool_parser = Parser(Lex(src), optimize=True)
+            my_cool_parser.optimizer = CheckedOptimizer(my_cool_parser)
+            my_cool_parser.parse_program()
+
+
+class TestGeneratedCCode(unittest.TestCase):
+    def c_output(self, parser, stdin="", structured=False):
         c_src = "/tmp/" + str(uuid.uuid4()) + ".c"
         c_bin = "/tmp/" + str(uuid.uuid4())
 
         with open(c_src, "w") as fp:
-            fp.write(c_equivalent)
+            fp.write(parser.gen_c_equivalent(structured=structured))
 
         subprocess.check_output(["gcc", "-o", c_bin, c_src])
-        actual_outputs = (subprocess.check_output(c_bin).decode("utf-8")).strip().split("\n")
-        self.assertEqual(expected_outputs, actual_outputs)
+        return (subprocess.check_output(c_bin, input=stdin.encode()).decode("utf-8")).strip().split("\n")
+
+    def assert_c_output_is(self, expected_outputs, src, stdin=""):
+        for optimize in (False, True):
+            my_cool_parser = Parser(Lex(src), optimize=optimize)
+            my_cool_parser.parse_program()
+            for structured in (False, True):
+                self.assertEqual(expected_outputs, self.c_output(my_cool_parser, stdin, structured))
 
     def test_basic_math(self):
         self.assert_c_output_is(["25", "-5", "1", "150"], src="""
@@ -181,6 +551,178 @@ class TestGeneratedCCode(unittest.TestCase):
         }.
         """)
 
+    def test_induction_variables(self):
+        for n in random.Random(16).sample(range(-5, 40), 5):
+            i, s, expected = 0, 0, []
+            while i < n:
+                s += i * 3 + i * 8 // 4 - (i - 1) * 5
+                expected.append(str(s))
+                i += 2
+            self.assert_c_output_is(expected + [str(i * 7)], stdin=str(n), src="""
+            program InductionVariables {
+                declare i, n, s;
+                input(n);
+                i := 0;
+                s := 0;
+                while (i < n) {
+                    s := s + i * 3 + i * 8 / 4 - (i - 1) * 5;
+                    print(s);
+                    i := i + 2
+                };
+                print(i * 7)
+            }.
+            """)
+
+    def test_inlined_subprograms(self):
+        my_cool_parser = Parser(Lex("""
+        program Inlined {
+            declare x, y, s, i;
+            function sq(in a) {
+                return (a * a)
+            }
+            function absdiff(in a, in b) {
+                declare d;
+                d := a - b;
+                if (d < 0) {
+                    return (0 - d)
+                };
+                return (d)
+            }
+            procedure swap(inout a, inout b) {
+                declare t;
+                t := a;
+                a := b;
+                b := t
+            }
+            input(x);
+            input(y);
+            i := 0;
+            s := 0;
+            while (i < 5) {
+                s := s + sq(in i) + absdiff(in x, in i);
+                call swap(inout x, inout y);
+                i := i + 1
+            };
+            print(s);
+            print(absdiff(in sq(in x), in sq(in y)));
+            call swap(inout x, inout x);
+            print(x)
+        }.
+        """), optimize=True, inline_threshold=10)
+        my_cool_parser.parse_program()
+
+        self.assertEqual(["Inlined"], [q.x for q in my_cool_parser.quads if q.op == "begin_block"])
+        self.assertEqual(["45", "40", "7"], self.c_output(my_cool_parser, stdin="3 7"))
+
+    def test_subprograms(self):
+        self.assert_c_output_is(["29", "2", "720", "5050"], stdin="6", src="""
+        program Subprograms {
+            declare s, n, r;
+            function fact(in k) {
+                if (k <= 1) return (1); else return (k * fact(in k - 1));;
+            }
+            procedure outer(in a, inout b) {
+                declare c;
+                procedure inner(inout d) {
+                    d := d + a + c;
+                    s := s + 1
+                }
+                c := 10;
+                call inner(inout b);
+                call inner(inout b)
+            }
+            function tailsum(in k, in acc) {
+                if (k = 0) return (acc); else return (tailsum(in k - 1, in acc + k));
+            }
+            input(n);
+            s := 0;
+            r := 5;
+            call outer(in 2, inout r);
+            print(r);
+            print(s);
+            print(fact(in n));
+            print(tailsum(in 100, in 0))
+        }.
+        """)
+
+    def test_nested_subprograms(self):
+        # p3 reaches the variables of p1 and p2 through their frames, and the inout parameters through pointers
+        self.assert_c_output_is(["112", "112", "164", "3", "25", "3", "12", "4"], stdin="4", src="""
+        program Nested {
+            declare x, y, fr, up;
+            procedure p1(inout a, in b) {
+                declare c, x;
+                function sq(in v) {
+                    return (v * v)
+                }
+                procedure bump(inout z) {
+                    z := z + 100;
+                    fr := fr + 1
+                }
+                procedure p2(inout d) {
+                    declare e;
+                    procedure p3(in k) {
+                        if (k > 0) {
+                            a := a + k;
+                            c := c + sq(in k);
+                            d := d + 1;
+                            e := e + x;
+                            call p3(in k - 1)
+                        }
+                    }
+                    e := 0;
+                    call p3(in b);
+                    up := e;
+                    call bump(inout e);
+                    print(e)
+                }
+                c := 0;
+                x := 3;
+                call p2(inout c);
+                call p2(inout a);
+                call bump(inout c);
+                print(c);
+                print(x)
+            }
+            input(x);
+            y := 1;
+            fr := 0;
+            call p1(inout y, in x);
+            print(y);
+            print(fr);
+            print(up);
+            print(x)
+        }.
+        """)
+
+    def test_structured_c(self):
+        my_cool_parser = Parser(Lex("""
+        program Fib {
+            declare i, n, a, b, tmp;
+            input(n);
+            i := 0;
+            while (i < n) {
+                i := i + 1;
+                switchcase
+                    case (i = 1) { a := 0; b := 0; }
+                    case (i = 2) { a := 0; b := 1; }
+                    default {
+                        tmp := a;
+                        a := b;
+                        b := b + tmp;
+                    };
+            };
+            print(b)
+        }.
+        """), optimize=True)
+        my_cool_parser.parse_program()
+
+        c_src = my_cool_parser.gen_c_equivalent(structured=True)
+        self.assertNotIn("goto", c_src)
+        self.assertIn("while (i < n) {", c_src)
+        self.assertIn("} else if (i ", c_src)
+        self.assertEqual(["8"], self.c_output(my_cool_parser, stdin="7", structured=True))
+
     def test_math_precedence(self):
         self.assert_c_output_is(["26", "30", "6", "-20", "-40"], src="""
         program MathPrecedence {
@@ -238,6 +780,23 @@ class TestGeneratedCCode(unittest.TestCase):
         }.
         """)
 
+    def test_constant_conditions(self):
+        self.assert_c_output_is(["10", "2", "-7", "1", "3"], src="""
+        program ConstantConditions {
+            declare a, b;
+
+            a := 2 * 3 + 4;
+            print(a);
+            b := a / 4;
+            print(b);
+            print(-(a - 3));
+            if (2 < 1) { print(0); } else { print(1); };
+            if (a = 10 and b <> 3) { a := 0; b := 3; };
+            while (a < b) { a := a + 1; };
+            print(a);
+        }.
+        """)
+
     def test_while(self):
         self.assert_c_output_is(["1", "2", "3", "4"], src="""
         program WhileSomethingDoSomething {
@@ -323,6 +882,194 @@ class TestGeneratedCCode(unittest.TestCase):
         """)
 
 
+class TestQuadInterpreter(unittest.TestCase):
+    def run_output(self, src, stdin="", **kwargs):
+        my_cool_parser = Parser(Lex(src), interpret=True, **kwargs)
+        my_cool_parser.parse_program()
+        stdout = io.StringIO()
+        my_cool_parser.interpreter.run(io.StringIO(stdin), stdout)
+        return stdout.getvalue().split()
+
+    def assert_run_output_is(self, expected_outputs, src, stdin=""):
+        for kwargs in ({}, {"optimize": True}, {"optimize": True, "inline_threshold": 20}, {"display": True}):
+            for jit in (False, True):
+                self.assertEqual(expected_outputs, self.run_output(src, stdin, jit=jit, **kwargs))
+
+    def test_examples(self):
+        self.assert_run_output_is(["34"], open("examples/02_fib1.ci").read(), stdin="10")
+        self.assert_run_output_is(["5"], open("examples/04_digitcount.ci").read(), stdin="12345")
+        self.assert_run_output_is(["10"], open("examples/06_sum.ci").read(), stdin="4")
+
+    def test_subprograms(self):
+        self.assert_run_output_is(["29", "2", "720", "5050"], stdin="6", src="""
+        program Subprograms {
+            declare s, n, r;
+            function fact(in k) {
+                if (k <= 1) return (1); else return (k * fact(in k - 1));;
+            }
+            procedure outer(in a, inout b) {
+                declare c;
+                procedure inner(inout d) {
+                    d := d + a + c;
+                    s := s + 1
+                }
+                c := 10;
+                call inner(inout b);
+                call inner(inout b)
+            }
+            function tailsum(in k, in acc) {
+                if (k = 0) return (acc); else return (tailsum(in k - 1, in acc + k));
+            }
+            input(n);
+            s := 0;
+            r := 5;
+            call outer(in 2, inout r);
+            print(r);
+            print(s);
+            print(fact(in n));
+            print(tailsum(in 100, in 0))
+        }.
+        """)
+
+    def test_division_truncates_towards_zero(self):
+        self.assert_run_output_is(["-3", "-3", "3", "-2147483648"], stdin="-7 2", src="""
+        program Division {
+            declare a, b;
+            input(a);
+            input(b);
+            print(a / b);
+            print((0 - a) / (0 - b));
+            print((0 - a) / b);
+            print(2147483647 + 1)
+        }.
+        """)
+
+    def test_division_by_zero(self):
+        for jit in (False, True):
+            with self.assertRaises(ZeroDivisionError):
+                self.run_output("program DivZero { declare a; input(a); print(1 / a) }.", stdin="0", jit=jit)
+
+    def test_input_errors(self):
+        src = "program Input { declare a, b; input(a); input(b); print(a + b) }."
+        for jit in (False, True):
+            with self.assertRaisesRegex(InputError, "end of input"):
+                self.run_output(src, stdin="1", jit=jit)
+            with self.assertRaisesRegex(InputError, "'abc'"):
+                self.run_output(src, stdin="1 abc", jit=jit)
+
+        with open("/tmp/" + str(uuid.uuid4()) + ".ci", "w") as fp:
+            fp.write(src)
+        result = subprocess.run([sys.executable, "cc.py", fp.name, "--run"], input="abc", capture_output=True,
+                                text=True)
+        os.remove(fp.name + ".asm")
+        os.remove(fp.name)
+        self.assertEqual(1, result.returncode)
+        self.assertEqual("ERROR: Expected a number in the input, got 'abc'.\n", result.stdout)
+
+    def test_deep_recursion(self):
+        src = """
+        program Deep {
+            function f(in n) { if (n = 0) { return (0) }; return (1 + f(in n - 1)) }
+            print(f(in 5000))
+        }.
+        """
+        with open("/tmp/" + str(uuid.uuid4()) + ".ci", "w") as fp:
+            fp.write(src)
+        results = {}
+        for flags in (["--run"], ["--jit"], ["--jit", "-O"]):
+            results[" ".join(flags)] = subprocess.run([sys.executable, "cc.py", fp.name] + flags, capture_output=True,
+                                                      text=True)
+        os.remove(fp.name + ".asm")
+        os.remove(fp.name)
+        self.assertEqual((0, "5000\n"), (results["--run"].returncode, results["--run"].stdout))
+        for flags in ("--jit", "--jit -O"):
+            self.assertEqual(1, results[flags].returncode)
+            self.assertEqual("ERROR: Recursion too deep, run the program with --run instead.\n", results[flags].stdout)
+            self.assertEqual("", results[flags].stderr)
+
+    def test_jit_compiles_once(self):
+        my_cool_parser = Parser(Lex(open("examples/04_digitcount.ci").read()), jit=True)
+        my_cool_parser.parse_program()
+        outputs = []
+        for stdin in ("7", "1234", "0"):
+            stdout = io.StringIO()
+            my_cool_parser.interpreter.run(io.StringIO(stdin), stdout)
+            outputs.append(stdout.getvalue())
+            if len(outputs) == 1:
+                namespace = my_cool_parser.interpreter.namespace
+        self.assertEqual(["1\n", "4\n", "0\n"], outputs)
+        self.assertIs(namespace, my_cool_parser.interpreter.namespace)
+        self.assertIn("while True:", my_cool_parser.interpreter.source)
+
+
+class TestRiscvSimulator(unittest.TestCase):
+    def simulate(self, src, stdin="", **kwargs):
+        my_cool_parser = Parser(Lex(src), **kwargs)
+        my_cool_parser.parse_program()
+        stdout = io.StringIO()
+        simulator = RiscvSimulator(my_cool_parser.asm_generator.gen_asm_equivalent(), io.StringIO(stdin), stdout)
+        stats = simulator.run(max_steps=10 ** 6)
+        self.assertEqual(0, simulator.exit_code)
+        return stdout.getvalue().split(), stats
+
+    def test_generated_code_runs_with_every_flag(self):
+        src = open("examples/05_primes.ci").read().replace("while (i <= 30)", "while (i <= 30) {") \
+            .replace("print(i);;", "print(i);; i := i + 1 };")
+        expected = ["2", "3", "5", "7", "11", "13", "17", "19", "23", "29"]
+        for kwargs in ({}, {"optimize": True}, {"regalloc": True}, {"display": True},
+                       {"optimize": True, "inline_threshold": 20, "regalloc": True, "display": True}):
+            self.assertEqual(expected, self.simulate(src, **kwargs)[0])
+        self.assertEqual(["34"], self.simulate(open("examples/02_fib1.ci").read(), stdin="10", optimize=True)[0])
+
+    def test_subprograms_and_division(self):
+        src = """
+        program Subprograms {
+            declare r, n;
+            function fact(in k) {
+                if (k <= 1) return (1); else return (k * fact(in k - 1));;
+            }
+            procedure twice(inout b) {
+                procedure add(inout d) {
+                    d := d + n
+                }
+                call add(inout b);
+                call add(inout b)
+            }
+            input(n);
+            r := 5;
+            call twice(inout r);
+            print(r);
+            print(fact(in n));
+            print((0 - 7) / 2);
+            print((0 - 7) / 4 * 16)
+        }.
+        """
+        for kwargs in ({}, {"optimize": True}, {"optimize": True, "regalloc": True}, {"display": True}):
+            self.assertEqual(["17", "720", "-3", "-16"], self.simulate(src, stdin="6", **kwargs)[0])
+
+    def test_input_errors(self):
+        src = "program Input { declare a, b; input(a); input(b); print(a + b) }."
+        with self.assertRaisesRegex(SimulationError, "end of input"):
+            self.simulate(src, stdin="1")
+        with self.assertRaisesRegex(SimulationError, "'abc'"):
+            self.simulate(src, stdin="1 abc")
+
+    def test_optimizations_execute_fewer_instructions(self):
+        src = open("examples/04_digitcount.ci").read()
+        _, plain = self.simulate(src, stdin="123456789")
+        _, optimized = self.simulate(src, stdin="123456789", optimize=True, regalloc=True)
+        self.assertEqual(9 + 1, plain["branches"])
+        self.assertLess(optimized["instructions"], plain["instructions"])
+        self.assertLess(optimized["loads"] + optimized["stores"], plain["loads"] + plain["stores"])
+        self.assertEqual(4, plain["ecalls"])  # input, print int, print newline, exit
+
+    def test_errors(self):
+        with self.assertRaises(SimulationError):
+            RiscvSimulator("__start:\n\tj Lmissing")
+        with self.assertRaises(SimulationError):
+            RiscvSimulator("__start:\n\tj __start").run(max_steps=100)
+
+
 class TestStValidations(unittest.TestCase):
     def parse(self, src):
         my_cool_parser = Parser(Lex(src))
@@ -505,3 +1252,275 @@ class TestStValidations(unittest.TestCase):
             call p1();
         }.
         """)
+
+
+class TestControlFlowGraph(unittest.TestCase):
+    def test_blocks_edges_and_dominators(self):
+        my_cool_parser = Parser(Lex("""
+        program p {
+            declare x;
+            procedure q(in a) {
+                print(a);
+            }
+            input(x);
+            while (x > 0) {
+                if (x = 3) {print(x)} else {call q(in x)};
+                x := x - 1
+            };
+            print(x)
+        }.
+        """))
+        my_cool_parser.parse_program()
+        q_cfg, cfg = ControlFlowGraph.regions(my_cool_parser.quads)
+
+        self.assertEqual(1, len(q_cfg.blocks))
+        self.assertEqual(my_cool_parser.quads[len(q_cfg.quads):], cfg.quads)
+        self.assertEqual(cfg.quads, [q for b in cfg.blocks for q in b.quads])
+
+        entry, cond, leave, if_cond, jump_else, then, other, join, after, end = cfg.blocks
+        self.assertEqual(["jump", "call", "jump"], [b.quads[-1].op for b in (jump_else, other, join)])
+
+        self.assertEqual([cond], entry.succs)
+        self.assertEqual([if_cond, leave], cond.succs)
+        self.assertEqual([entry, join], cond.preds)  # join has the back edge of the loop
+        self.assertEqual([then, other], join.preds)
+        self.assertEqual([], after.succs)  # halt
+
+        self.assertTrue(cfg.dominates(cond, join))
+        self.assertTrue(cfg.dominates(if_cond, join))
+        self.assertFalse(cfg.dominates(then, join))
+        self.assertFalse(cfg.dominates(other, join))
+        self.assertNotIn(end, cfg.order)  # unreachable after halt
+        self.assertEqual({cond: {cond, if_cond, jump_else, then, other, join}}, cfg.loops())
+
+
+class TestAsmGenerator(unittest.TestCase):
+    def compile(self, src):
+        my_cool_parser = Parser(Lex(src))
+        my_cool_parser.parse_program()
+        return my_cool_parser
+
+    def test_every_quad_is_compiled_once(self):
+        parser = self.compile("""
+        program blocks {
+            declare x;
+            procedure p1(in a) {
+                procedure p11(in b) {
+                    print(b);
+                }
+                call p11(in a);
+            }
+            procedure p2(in a) {
+                print(a);
+            }
+            call p1(in x);
+            call p2(in x);
+        }.
+        """)
+        labels = [s[:-1] for s in parser.asm_generator.statements if s.startswith("L_")]
+        self.assertEqual([q.label for q in parser.quads], labels)
+
+    def test_strength_reduction(self):
+        parser = Parser(Lex("""
+        program shifts {
+            declare x;
+            input(x);
+            print(x * 8);
+            print(x / 4);
+            print(x - 1)
+        }.
+        """), optimize=True, regalloc=True)
+        parser.parse_program()
+        statements = parser.asm_generator.statements
+        self.assertNotIn("mul", " ".join(statements))
+        self.assertNotIn("div", " ".join(statements))
+        self.assertIn("slli t4,t3,3", statements)  # x is in t3
+        self.assertIn("addi t6,t3,-1", statements)
+
+        division = statements[statements.index("srai t0,t3,31"):][:4]
+        values = [0, 1, 3, 4, 5, -1, -3, -4, -5, -7, 2 ** 31 - 1, -2 ** 31]
+        values += random.Random(16).sample(range(-10 ** 6, 10 ** 6), 50)
+        for x in values:
+            regs = {"t3": x}
+            for ins in division:  # srai t0,t3,31 / srli t0,t0,30 / add t0,t3,t0 / srai t5,t0,2
+                op, (rd, rs, arg) = ins.split(" ")[0], ins.split(" ")[1].split(",")
+                v = {"srai": lambda: regs[rs] >> int(arg), "srli": lambda: (regs[rs] % 2 ** 32) >> int(arg),
+                     "add": lambda: regs[rs] + regs[arg]}[op]()
+                regs[rd] = (v + 2 ** 31) % 2 ** 32 - 2 ** 31
+            self.assertEqual(int(x / 4), regs["t5"], x)
+
+    def test_peephole(self):
+        parser = Parser(Lex("""
+        program peephole {
+            declare x, y;
+            input(x);
+            if (x > 0) {
+                y := x + 2
+            };
+            print(y)
+        }.
+        """), optimize=True)
+        parser.parse_program()
+        statements = parser.asm_generator.statements
+
+        self.assertIn("mv t1,a0", statements)  # x was just stored from a0
+        self.assertEqual(["sw t1,-20(sp)", "sw t1,-16(sp)", "L_8:", "lw a0,-16(sp)"],  # only jump targets are labeled
+                         statements[statements.index("L_8:") - 2:statements.index("L_8:") + 2])
+        self.assertEqual({"load after store": 2, "jump to next": 0, "dead move": 1, "unreachable": 0},
+                         parser.asm_generator.peephole_stats)
+
+    def test_tail_calls_reuse_the_frame(self):
+        parser = Parser(Lex("""
+        program tail {
+            declare x;
+            function add(in a, in b) {
+                return (a + b)
+            }
+            procedure inc(inout y) {
+                y := y + 1
+            }
+            function twice(in a, in b, in c) {
+                declare d;
+                d := c * 2;
+                return (add(in a, in b + d))
+            }
+            procedure bump(in a) {
+                call inc(inout a)
+            }
+            print(twice(in 1, in 2, in 3));
+            call bump(in x)
+        }.
+        """), optimize=True)
+        parser.parse_program()
+        statements = parser.asm_generator.statements
+        twice = statements[statements.index("twice__2:"):statements.index("bump__3:")]
+
+        self.assertNotIn("jal add__0", twice)
+        self.assertIn("j add__0", twice)
+        self.assertEqual(["lw t0,-8(sp)", "sw t0,-8(fp)", "lw ra,(sp)"],  # add returns twice's result
+                         twice[twice.index("sw t0,-4(fp)") + 1:][:3])
+        self.assertIn("add__0", parser.asm_generator.compiled_blocks["twice__2"]["calls"])
+        self.assertIn("jal inc__1", statements)  # inc gets the address of a, in bump's frame
+
+    def test_leaf_subprograms_use_the_frame_of_the_call(self):
+        parser = Parser(Lex("""
+        program leaves {
+            declare x;
+            function square(in a) {
+                return (a * a)
+            }
+            function twice(in a) {
+                return (square(in a) + square(in a + 1))
+            }
+            print(twice(in 3))
+        }.
+        """), optimize=True, regalloc=True)
+        parser.parse_program()
+        statements = parser.asm_generator.statements
+        square = statements[statements.index("square__0:"):statements.index("twice__1:")]
+        twice = statements[statements.index("twice__1:"):statements.index("Lmain:")]
+
+        # square never calls anything, so ra stays as it is and a is read through fp, which twice points to it
+        self.assertEqual(["square__0:", "lw t3,-12(fp)", "mul t4,t3,t3", "lw t0,-8(fp)", "sw t4,(t0)", "jr ra"],
+                         square)
+        self.assertIn("jal square__0", twice)
+        self.assertEqual(1, twice.count("jr ra"))  # the epilogue of end_block after the one of retv is dropped
+        # only the frames of twice and main move sp
+        self.assertEqual(["sw ra,(sp)", "addi sp,sp,20", "addi sp,sp,32", "jal twice__1", "addi sp,sp,-32"],
+                         [s for s in statements if s.startswith(("addi sp", "jal twice", "sw ra"))])
+
+    def test_display(self):
+        src = """
+        program display {
+            declare s;
+            procedure p1() {
+                declare a;
+                procedure p2() {
+                    procedure p3() {
+                        s := s + a
+                    }
+                    call p3()
+                }
+                a := 1;
+                call p2()
+            }
+            call p1();
+            print(s)
+        }.
+        """
+        parser = Parser(Lex(src), display=True)
+        parser.parse_program()
+        statements = parser.asm_generator.statements
+        p3 = statements[statements.index("p3__0:"):statements.index("p2__1:")]
+        p1 = [s for s in statements[statements.index("p1__2:"):statements.index("Lmain:")] if not s.endswith(":")]
+
+        # p1 and p2 have nested subprograms, at levels 1 and 2, main's frame is in gp
+        self.assertIn("display: .space 12", parser.asm_generator.gen_asm_equivalent())
+        self.assertEqual(["lw t0,4(tp)", "addi t0,t0,-12", "lw t2,(t0)"], p3[p3.index("lw t0,4(tp)"):][:3])
+        self.assertNotIn("-4(sp)", " ".join(statements))  # no access links
+        # p1 saves the previous level 1 entry in its frame and restores it when it returns
+        self.assertEqual(["lw t0,4(tp)", "sw t0,-16(sp)", "sw sp,4(tp)"], p1[1:4])
+        self.assertEqual(["lw t0,-16(sp)", "sw t0,4(tp)", "lw ra,(sp)", "jr ra"], p1[-4:])
+        self.assertIn("la tp,display", statements)
+
+    def test_register_allocation(self):
+        parser = Parser(Lex("""
+        program regs {
+            declare x;
+            function f(in a) {
+                declare b;
+                b := a * 2 + 1;
+                return (b * b)
+            }
+            x := f(in 3);
+            print(x)
+        }.
+        """), regalloc=True)
+        parser.parse_program()
+        statements = parser.asm_generator.statements
+        body = statements[statements.index("f__0:"):statements.index("Lmain:")]
+
+        # only the parameter is read from memory, no values of a or b or the temporaries are stored
+        self.assertEqual({"sw ra,(sp)", "lw t3,-12(sp)", "lw t0,-8(sp)", "sw t3,(t0)", "lw ra,(sp)"},
+                         {s for s in body if s.startswith("lw") or s.startswith("sw")})
+
+    def test_register_allocation_keeps_shared_variables_in_memory(self):
+        parser = Parser(Lex("""
+        program regs {
+            declare x, y;
+            procedure inc(inout a) {
+                a := a + x;
+            }
+            x := 1;
+            y := 2;
+            call inc(inout y);
+            print(x + y)
+        }.
+        """), regalloc=True)
+        parser.parse_program()
+        statements = parser.asm_generator.statements
+        main = statements[statements.index("Lmain:"):]
+
+        self.assertIn("sw t1,-12(sp)", main)  # x is read by inc
+        self.assertIn("addi t0,sp,-16", main)  # y is passed by reference
+
+
+class TestSymbolTable(unittest.TestCase):
+    def test_shadowed_symbols_are_restored(self):
+        st = SymbolTable(None)
+        st.create_scope("main")
+        st.add_new_entity("variables", "a", {})
+        st.add_new_entity("functions", "f", {})
+        st.create_scope("f")
+        st.add_new_entity("parameters", "a", {"mode": "in"})
+        st.add_new_entity("variables", "f", {})
+
+        self.assertEqual(1, st.find_entity("a")["scope"])
+        self.assertEqual(0, st.find_entity("a", categories=("variables",))["scope"])
+        self.assertEqual(0, st.find_entity("f", categories=("functions",))["scope"])
+        self.assertIsNone(st.find_entity("f", categories=("functions",), max_depth=1))
+
+        st.pop_scope()
+        self.assertEqual({"offset": 12, "scope": 0}, st.find_entity("a"))
+        self.assertEqual(0, st.find_entity("f")["scope"])
+        self.assertIsNone(st.find_entity("f", categories=("variables",)))